@@ -1,33 +1,71 @@
+import time
+startTime = time.perf_counter()
+
+import sys
 import pickle
-import numpy as np
+import threading
 import tkinter as tk
 
-from PIL import Image
-from PIL import ImageTk
-
-from videoProcessing import VideoProcessing, imagesToVideo
-from stickmanFrames import StickmanFrames
+# Only modules that load quickly are imported here. Those that need numpy,
+# OpenCV or PIL are imported on a thread while the window is built (see
+# importModules and startup below)
 from configWindow import ConfigWindow
+from renderScheduler import RenderScheduler
+from figureCanvas import FigureCanvas
+from playback import PlaybackClock
+from history import History
+from memoryManager import MemoryManager
+from settings import Settings
 
 from tkinter.filedialog import askopenfilename as askopenfilename
 from tkinter.filedialog import askopenfilenames as askopenfilenames
 from tkinter.filedialog import asksaveasfilename as asksaveasfilename
 from tkinter.filedialog import askdirectory as askdirectory
+from tkinter.simpledialog import askinteger as askinteger
+from tkinter.simpledialog import askstring as askstring
 
 # Constants to control application's behaviour
 global frameSize, stickyMode, videoPath, savePath, video, stickyFrames, repeatDraw, actualFrame
+global playbackClock, nodeTracker, trackedFrame, rangeLast, dragStart
 global configWindow, nodeColor, lineColor, selectedColor, exportColor, lineThickness, frameJump
+global onionFrames, onionOpacity, prefetchDepth, exportWorkers, pngCompression
+global exportAntialias, exportSupersample
+global startupResult, startupBudget
+
+# With --startup-benchmark [milliseconds] the app reports how long it took to
+# show the window and the first video frame, and exits with an error if the
+# window took longer than the budget
+STARTUP_BUDGET = 500
+startupBudget = None
+if '--startup-benchmark' in sys.argv:
+    startupBudget = STARTUP_BUDGET
+    index = sys.argv.index('--startup-benchmark')
+    if index + 1 < len(sys.argv) and sys.argv[index+1].isdigit():
+        startupBudget = int(sys.argv[index+1])
 
 # Some constants to use throughout the script
 ADD_NODE, EDIT_NODE, MOVE_NODE, DELETE_NODE, ADD_LINE, ADD_CIRCLE = 0, 1, 2, 3, 4, 5
+SELECT_NODES = 6
+EDIT_EDGE = 7
+
+# Settings saved for this user (see settings.py). Performance settings come
+# from the active profile and are applied by applyPerformance
+settings = Settings()
+settings.load()
 
 # Variables related to the drawing
-nodeColor = (0, 255, 0)
-lineColor = (0, 255, 0)
-selectedColor = (255, 0, 0)
-exportColor = (0, 0, 0)
-lineThickness = 10
-frameJump = 1
+nodeColor = settings.general['nodeColor']
+lineColor = settings.general['lineColor']
+selectedColor = settings.general['selectedColor']
+exportColor = settings.general['exportColor']
+lineThickness = settings.general['lineThickness']
+frameJump = settings.general['frameJump']
+
+# Onion skin is off until the user sets how many ghost frames to show. The
+# OnionSkin itself is created once its module is loaded
+onionFrames = settings.general['onionFrames']
+onionOpacity = settings.general['onionOpacity']
+onionSkin = None
 
 # Control variables
 frameSize = (600, 800, 3)
@@ -35,58 +73,225 @@ stickyMode = ADD_NODE
 repeatDraw = True
 actualFrame = 0
 
-# Initial application state
+# playbackClock is None unless the animation is playing
+playbackClock = None
+# nodeTracker is None unless nodes are being tracked. trackedFrame is the
+# frame they come from, as it was when tracking started
+nodeTracker = trackedFrame = None
+# Last frame group operations apply to. None (or a frame before the actual
+# one) means only the actual frame
+rangeLast = None
+# Where the mouse was pressed when selecting with a rectangle
+dragStart = None
+
+# Initial application state. The splash video and the animation are created
+# at startup, once their modules are loaded
 videoPath = 'initialScreen.avi'
-video = VideoProcessing(videoPath)
-stickmanFrames = StickmanFrames()
+video = None
+stickmanFrames = None
+
+# Undo history of the animation. It is kept when a project is loaded
+history = History()
+
+# Caches and buffers are kept within the memory budget (see startup)
+memoryManager = MemoryManager()
+
+# Frames decoded ahead while idle (see prefetch) and how images are exported
+prefetchDepth = 0
+exportWorkers = 1
+pngCompression = 3
+exportAntialias = False
+exportSupersample = 1
+prefetchJob = None
+
+# Use the performance settings of the active profile
+def applyPerformance():
+    global prefetchDepth, exportWorkers, pngCompression
+    global exportAntialias, exportSupersample
+    values = settings.performance()
+    prefetchDepth = values['prefetchDepth']
+    exportWorkers = values['exportWorkers']
+    pngCompression = values['pngCompression']
+    exportAntialias = values['exportAntialias'] != 0
+    exportSupersample = values['exportSupersample']
+    memoryManager.budget = max(values['memoryBudget'], 64) * 2**20
+    if video is not None:
+        configureVideo(video)
+
+# Settings of a video just opened. Frames decoded ahead must fit the cache
+# together with the frame on screen. The video replaces the one before in
+# the memory budget, and is the first to be evicted from
+def configureVideo(video):
+    memoryManager.register('Video', video.nBytes, video.evict, 0)
+    values = settings.performance()
+    video.setCacheSize(max(values['decodeCacheSize'], values['prefetchDepth'] + 2))
+    video.previewDownscale = values['previewDownscale']
+
+applyPerformance()
+
+# Import the modules that need numpy, OpenCV and PIL. Their names become
+# globals of this script, as if they were imported at the top
+def importModules():
+    global VideoProcessing, imagesToVideo, StickmanFrames, INTERPOLATION_MODES
+    global OnionSkin, NodeTracker, ViewTransform, RenderEngine, poseData
+    from videoProcessing import VideoProcessing, imagesToVideo
+    from stickmanFrames import StickmanFrames, INTERPOLATION_MODES
+    from onionSkin import OnionSkin
+    from nodeTracker import NodeTracker
+    from viewTransform import ViewTransform
+    from renderEngine import RenderEngine
+    import poseData
+    import PIL.ImageTk
+
+# Runs on a thread while the window is built: import the heavy modules and
+# open and decode the splash video. startupResult is the video, or the error
+# that stopped the loading
+def loadInBackground():
+    global startupResult
+    try:
+        importModules()
+        splash = VideoProcessing(videoPath)
+        splash.setFrame(0, frameSize)
+        startupResult = splash
+    except Exception as error:
+        startupResult = error
+
+startupResult = None
+startupThread = threading.Thread(target=loadInBackground, daemon=True)
+startupThread.start()
 
 # savePath is None until a place has been entered
 savePath = None
 
-# Update the stickman drawing on screen
-def updateDraw():
-    # Copy actual frame
-    image = np.copy(video.getFrame())
-    stickmanFrames.drawFigure(actualFrame, image, lineThickness,
-                              lineColor, nodeColor, selectedColor)
-    
-    # Place on the right label
-    image = Image.fromarray(image)
-    image = ImageTk.PhotoImage(image)
-    imLabel.configure(image=image)
-    imLabel.image = image
+# Update the stickman drawing on screen. Only the canvas items that changed
+# are touched, the video frame stays as it is
+def updateDraw(preview = False):
+    transform = video.viewTransform()
+    # Previews use thin lines, the full drawing comes with the next render
+    thickness = 1 if preview else stickmanFrames.thicknessFor(lineThickness, transform)
+    imCanvas.drawFigure(stickmanFrames.getFrame(actualFrame), transform,
+                        thickness, lineColor, nodeColor, selectedColor,
+                        hidden=stickmanFrames.hiddenFigures())
+
+# Place the processed video frame behind the drawing, with the onion skin
+# ghosts of the surrounding frames blended on it (not on previews)
+def updateBackground(preview = False):
+    if preview:
+        imCanvas.setBackground(video.getFrame())
+        return
+    transform = video.viewTransform()
+    image = onionSkin.composite(video.getFrame(), stickmanFrames, actualFrame,
+                                transform,
+                                stickmanFrames.thicknessFor(lineThickness, transform))
+    imCanvas.setBackground(image)
+
+# Nodes are kept in source video coordinates. Map a point on the canvas
+# (like a mouse click) to them
+def toSource(x, y):
+    x, y = video.viewTransform().toSource([(x, y)])[0]
+    return float(x), float(y)
 
-# Go to right frame on the video. If it is valid
+# Nodes are selected when clicked closer than 24 pixels on screen
+def selectionThreshold():
+    return video.viewTransform().lengthToSource(24)
+
+# Go to right frame on the video. If it is valid. The frame is shown on the
+# next render, together with any other pending change
 def setFrame(frameIndex = None):
+    if frameIndex is not None and frameIndex < 0:
+        return
+    renderScheduler.requestFrame(frameIndex)
+
+# Apply every change requested since the last render. The video frame is
+# decoded and processed at most once and the drawing is updated once
+def render(pending):
     global actualFrame
-    if frameIndex < 0:
+    
+    # Nothing to show until startup is done
+    if video is None:
         return
     
-    if frameIndex is None or frameIndex < video.nFrames:
-        video.setFrame(frameIndex, frameSize)
+    # Zoom and translation only change the view, frame is processed below
+    if pending.zoom != 0:
+        video.zoom(pending.zoom, update=False)
+    if pending.translation != [0, 0]:
+        video.translate(*pending.translation, update=False)
     
+    frameIndex = pending.frameIndex
     if frameIndex is not None:
         actualFrame = frameIndex
         entryText.set(str(frameIndex+1) + '/' + str(video.nFrames))
-        if repeatDraw:
-            stickmanFrames.repeatByCopy(frameIndex)
-    updateDraw()
+        # While playing we only show frames, never create them. The copy
+        # made when arriving at a frame is not an undo step: undo goes back
+        # to the last edit, and what could be redone is kept
+        if repeatDraw and playbackClock is None:
+            with stickmanFrames.silently():
+                stickmanFrames.repeatByCopy(frameIndex)
+    
+    if pending.frameChanged or pending.viewChanged():
+        if frameIndex is None:
+            video.setFrame(None, frameSize, pending.preview)
+        elif frameIndex < video.nFrames:
+            video.setFrame(frameIndex, frameSize, pending.preview)
+        updateBackground(pending.preview)
+        # The next frames are likely to be asked soon
+        if not pending.preview and playbackClock is None:
+            schedulePrefetch()
+    updateDraw(pending.preview)
+
+# Decode the frames after the actual one (frameJump apart) while the app is
+# idle, so stepping forward finds them in the cache. One frame is decoded on
+# each idle moment, so input is never kept waiting
+def schedulePrefetch():
+    global prefetchJob
+    if prefetchJob is not None:
+        root.after_cancel(prefetchJob)
+    prefetchJob = root.after_idle(prefetch, actualFrame + frameJump, prefetchDepth)
+
+def prefetch(frameIndex, remaining):
+    global prefetchJob
+    prefetchJob = None
+    # Stop on the end of the video, or if a render is waiting
+    if remaining <= 0 or frameIndex >= video.nFrames or\
+       renderScheduler.scheduled is not None:
+        return
+    video.decode(frameIndex)
+    prefetchJob = root.after_idle(prefetch, frameIndex + frameJump, remaining - 1)
 
 def configWindowClosed():
     global configWindow, nodeColor, lineColor, selectedColor, exportColor, lineThickness, frameJump
+    global onionFrames, onionOpacity
     nodeColor     = configWindow.getColor('Node')
     lineColor     = configWindow.getColor('Edge')
     selectedColor = configWindow.getColor('Selected')
     exportColor   = configWindow.getColor('Export')
     lineThickness = configWindow.getLineThickness()
     frameJump     = configWindow.getFrameJump()
-    updateDraw()
+    onionFrames   = configWindow.getOnionFrames()
+    onionOpacity  = configWindow.getOnionOpacity()
+    onionSkin.configure(onionFrames, onionOpacity)
+    
+    # Everything is kept for the next time the app runs
+    settings.general.update(nodeColor=nodeColor, lineColor=lineColor,
+                            selectedColor=selectedColor, exportColor=exportColor,
+                            lineThickness=lineThickness, frameJump=frameJump,
+                            onionFrames=onionFrames, onionOpacity=onionOpacity)
+    settings.profiles = configWindow.getProfiles()
+    settings.useProfile(configWindow.getProfile())
+    if not settings.save():
+        statusText.set('Could not save settings to ' + settings.path)
+    applyPerformance()
+    checkMemory(repeat=False)
+    # Ghosts are part of the background, so it has to be composed again
+    renderScheduler.requestFrame()
 
 def openConfigWindow():
         global configWindow, nodeColor, lineColor, selectedColor, exportColor, lineThickness, frameJump
         # Creates progress bar (immediatly appears on screen)
         configWindow = ConfigWindow(root, nodeColor, lineColor, selectedColor,
-                              exportColor, lineThickness, frameJump, configWindowClosed)
+                              exportColor, lineThickness, frameJump, configWindowClosed,
+                              onionFrames, onionOpacity, settings.profiles,
+                              settings.profile)
 
 # Called everytime the user clicks on ok
 def entryCallback():
@@ -97,91 +302,150 @@ def entryCallback():
         return
     setFrame(frameIndex)
 
-# Set previous frame
+# Set previous frame. Quick steps are shown as previews
 def previousFrame():
+    renderScheduler.markInteraction()
     setFrame(actualFrame-frameJump)
 
 # Select next frame
 def nextFrame():
+    renderScheduler.markInteraction()
     setFrame(actualFrame+frameJump)
 
+# Start or stop real time playback from the current frame
+def togglePlay():
+    global playbackClock
+    if playbackClock is None:
+        playbackClock = PlaybackClock(video.fps, actualFrame)
+        playButton.configure(text='Pause')
+        playbackTick()
+    else:
+        stopPlayback()
+
+def stopPlayback():
+    global playbackClock
+    if playbackClock is None:
+        return
+    statusText.set('Played at ' + playbackClock.describe())
+    playbackClock = None
+    playButton.configure(text='Play')
+
+# Show the frame due now and schedule the next one. Late frames are dropped,
+# so the animation keeps the timing of the video
+def playbackTick():
+    if playbackClock is None:
+        return
+    
+    frameIndex = playbackClock.nextFrame()
+    if frameIndex is not None:
+        lastFrame = max(video.nFrames, len(stickmanFrames)) - 1
+        if frameIndex > lastFrame:
+            stopPlayback()
+            return
+        renderScheduler.requestFrame(frameIndex)
+        renderScheduler.flush()
+        statusText.set('Playing at ' + playbackClock.describe())
+    root.after(playbackClock.delayToNext(), playbackTick)
+
 # Reads user imput for common inputs. Those are used to control the video
 # position and zooming
 def keyboardInput(event):
     if len(event.char) == 0:
         return
     key = ord(event.char)
+    if event.char in '-+adsw':
+        renderScheduler.markInteraction()
     if key == ord('-'):
-        video.zoom(-10)
-        setFrame()
+        renderScheduler.requestZoom(-10)
     if key == ord('+'):
-        video.zoom(+10)
-        setFrame()
+        renderScheduler.requestZoom(+10)
     if key == ord('a'):
-        video.translate(x = -10)
-        setFrame()
+        renderScheduler.requestTranslation(x = -10)
     if key == ord('d'):
-        video.translate(x = +10)
-        setFrame()
+        renderScheduler.requestTranslation(x = +10)
     if key == ord('s'):
-        video.translate(y = +10)
-        setFrame()
+        renderScheduler.requestTranslation(y = +10)
     if key == ord('w'):
-        video.translate(y = -10)
-        setFrame()
+        renderScheduler.requestTranslation(y = -10)
+    if key == ord(' '):
+        togglePlay()
+    
+    # Group transforms of the selected nodes
+    if stickyMode == SELECT_NODES:
+        if key == ord('q'):
+            rotateSelection(-5)
+        if key == ord('e'):
+            rotateSelection(+5)
+        if key == ord('z'):
+            scaleSelection(1 / 1.05)
+        if key == ord('x'):
+            scaleSelection(1.05)
+    
+    # Switch the selected edge between line and circle
+    if stickyMode == EDIT_EDGE and key == ord('t'):
+        edgeIndex = stickmanFrames.selectedEdge(actualFrame)
+        if edgeIndex is not None:
+            stickmanFrames.toggleEdgeType(actualFrame, edgeIndex)
+            renderScheduler.requestDraw()
 
 # Zooming on mouse wheel    
 def mouseWheelEvent(event):
     amount = event.delta / 12
-    video.zoom(amount)
-    setFrame()
+    renderScheduler.markInteraction()
+    renderScheduler.requestZoom(amount)
 
 # Event for mouse click.
 # Mouse is used for editting the figure
 def mouseClick(event):
-    global stickyMode
+    global stickyMode, dragStart
     
-    # We only use clicks on the main label. With the exception of the frame
+    # We only use clicks on the main canvas. With the exception of the frame
     # entry, where we erase the text
-    if event.widget is not imLabel:
+    if event.widget is not imCanvas:
         if event.widget is entryFrame:
             entryText.set('')
         return
     
     # Get current index and see the state to interact
     frameIndex = actualFrame
-    if stickyMode == ADD_NODE:
+    x, y = toSource(event.x, event.y)
+    threshold = selectionThreshold()
+    if stickyMode == SELECT_NODES:
+        # Selection happens when the button is released (see mouseRelease)
+        dragStart = (event.x, event.y)
+        
+    elif stickyMode == ADD_NODE:
         # Add a node and update
-        stickmanFrames.insertNode(frameIndex, event.x, event.y)
-        updateDraw()
+        stickmanFrames.insertNode(frameIndex, x, y)
+        renderScheduler.requestDraw()
         
     elif stickyMode == EDIT_NODE:
         # See if any node is selected. If not, select one
         # If a node is selected, mode to mouse position
         nodeIndex = stickmanFrames.selectedNode(frameIndex)
         if nodeIndex is None:
-            stickmanFrames.selectNode(frameIndex, event.x, event.y)
+            stickmanFrames.selectNode(frameIndex, x, y, threshold=threshold)
         else:
-            stickmanFrames.editNode(frameIndex, nodeIndex, event.x, event.y)
+            stickmanFrames.editNode(frameIndex, nodeIndex, x, y)
             stickmanFrames.unselectNodes(frameIndex)
-        updateDraw()
+        renderScheduler.requestDraw()
         
     elif stickyMode == MOVE_NODE:
         # Supose the user used the arrow keys to move a selected node, than we
         # are here. This select a node and sends back to edit mode. The user
         # has no knowledge of this
-        stickmanFrames.selectNode(frameIndex, event.x, event.y)
+        stickmanFrames.selectNode(frameIndex, x, y, threshold=threshold)
         stickyMode = EDIT_NODE
-        updateDraw()
+        renderScheduler.requestDraw()
         
     elif stickyMode == DELETE_NODE:
         # Select (if mouse is close) and delete any node. Also, edges are
         # update to reflect changes
-        stickmanFrames.selectNode(frameIndex, event.x, event.y)
+        stickmanFrames.selectNode(frameIndex, x, y, threshold=threshold)
         selected = stickmanFrames.selectedNode(frameIndex)
         if selected is not None:
             stickmanFrames.removeNode(frameIndex, selected)
-        updateDraw()
+        renderScheduler.requestDraw()
         
     elif stickyMode == ADD_LINE or stickyMode == ADD_CIRCLE:
         # The only difference between line and circle is the edgeType argument.
@@ -190,17 +454,124 @@ def mouseClick(event):
         edgeType = 'line' if stickyMode == ADD_LINE else 'circle'
         nodeIndex = stickmanFrames.selectedNode(frameIndex)
         if nodeIndex is None:
-            stickmanFrames.selectNode(frameIndex, event.x, event.y)
+            stickmanFrames.selectNode(frameIndex, x, y, threshold=threshold)
         else:
-            newIndex = stickmanFrames.insertNode(frameIndex, event.x, event.y)
-            stickmanFrames.insertEdge(frameIndex, nodeIndex, newIndex, edgeType)
-            stickmanFrames.selectNode(frameIndex, event.x, event.y)
-        updateDraw()
+            # Node and edge are undone together
+            with history.group():
+                newIndex = stickmanFrames.insertNode(frameIndex, x, y)
+                stickmanFrames.insertEdge(frameIndex, nodeIndex, newIndex, edgeType)
+            stickmanFrames.selectNode(frameIndex, x, y, threshold=threshold)
+        renderScheduler.requestDraw()
+        
+    elif stickyMode == EDIT_EDGE:
+        # Select the closest edge, to delete it or change its type
+        stickmanFrames.selectEdge(frameIndex, x, y, threshold=threshold)
+        renderScheduler.requestDraw()
+
+# While selecting, dragging the mouse shows the selection rectangle
+def mouseDrag(event):
+    if stickyMode == SELECT_NODES and dragStart is not None:
+        imCanvas.showRubberBand(dragStart[0], dragStart[1], event.x, event.y)
+
+# Finish a selection. A drag selects every node inside the rectangle, a
+# simple click selects the closest node. With shift pressed, nodes are added
+# to the selection (or removed, on click)
+def mouseRelease(event):
+    global dragStart
+    if stickyMode != SELECT_NODES or dragStart is None:
+        return
+    
+    shift = (event.state & 0x1) != 0
+    x1, y1 = dragStart
+    dragStart = None
+    imCanvas.hideRubberBand()
+    
+    # The rectangle is drawn on screen, nodes are selected in the source
+    if abs(event.x - x1) > 3 or abs(event.y - y1) > 3:
+        x1, y1 = toSource(x1, y1)
+        x2, y2 = toSource(event.x, event.y)
+        stickmanFrames.selectNodesInRect(actualFrame, x1, y1, x2, y2, shift)
+    else:
+        x, y = toSource(event.x, event.y)
+        stickmanFrames.selectNode(actualFrame, x, y, toggle=shift,
+                                  threshold=selectionThreshold())
+    renderScheduler.requestDraw()
+
+# After a group operation only the figure is drawn again. The background
+# changes only if other frames changed and are shown as onion skin ghosts
+def requestGroupRender():
+    if rangeLast is not None and onionFrames > 0:
+        renderScheduler.requestFrame()
+    else:
+        renderScheduler.requestDraw()
+
+# Transform the selected nodes as a group. Applies to every frame up to
+# rangeLast, if a range is set
+def translateSelection(dx, dy):
+    selected = stickmanFrames.selectedNodes(actualFrame)
+    if len(selected) > 0:
+        stickmanFrames.translateNodes(actualFrame, selected, dx, dy, rangeLast)
+        requestGroupRender()
+
+def rotateSelection(angle):
+    selected = stickmanFrames.selectedNodes(actualFrame)
+    if len(selected) > 1:
+        stickmanFrames.rotateNodes(actualFrame, selected, angle, rangeLast)
+        requestGroupRender()
+
+def scaleSelection(factor):
+    selected = stickmanFrames.selectedNodes(actualFrame)
+    if len(selected) > 1:
+        stickmanFrames.scaleNodes(actualFrame, selected, factor, rangeLast)
+        requestGroupRender()
+
+# Remove all selected nodes (on the range, if set), or the selected edge
+def deleteSelection(event = None):
+    if event is not None and event.widget is entryFrame:
+        return
+    if stickyMode == EDIT_EDGE:
+        edgeIndex = stickmanFrames.selectedEdge(actualFrame)
+        if edgeIndex is not None:
+            stickmanFrames.removeEdge(actualFrame, edgeIndex)
+            renderScheduler.requestDraw()
+        return
+    if stickyMode != SELECT_NODES:
+        return
+    selected = stickmanFrames.selectedNodes(actualFrame)
+    if len(selected) > 0:
+        stickmanFrames.removeNodes(actualFrame, selected, rangeLast)
+        requestGroupRender()
+
+# Ask the last frame of the range for group operations. Clicking again
+# turns the range off
+def toggleRange():
+    global rangeLast
+    if rangeLast is not None:
+        rangeLast = None
+        rangeButton.configure(text='Range', relief='raised')
+        return
+    
+    last = askinteger('Range', 'Apply group operations up to frame:',
+                      initialvalue=max(len(stickmanFrames), actualFrame+1),
+                      minvalue=actualFrame+1)
+    if last is not None:
+        rangeLast = last - 1
+        rangeButton.configure(text='Range: ' + str(last), relief='sunken')
 
 # An special state is generated to handle node editting by keyboard
 def moveNode(event):
     global stickyMode
     
+    # Arrows move one pixel on screen, whatever the zoom
+    step = video.viewTransform().lengthToSource(1)
+    
+    # With many nodes selected, arrows move all of them
+    if stickyMode == SELECT_NODES:
+        dx = {'Right': step, 'Left': -step}.get(event.keysym, 0)
+        dy = {'Down': step, 'Up': -step}.get(event.keysym, 0)
+        translateSelection(dx, dy)
+        return
+    
     # If EDIT_MODE, set MOVE_NODE. Translate node by one unit accorfing to
     # user input
     if stickyMode == EDIT_NODE or stickyMode == MOVE_NODE:
@@ -213,16 +584,17 @@ def moveNode(event):
         newX, newY = node.x, node.y
         
         if event.keysym == 'Right':
-            newX += 1
+            newX += step
         elif event.keysym == 'Left':
-            newX -= 1
+            newX -= step
         elif event.keysym == 'Up':
-            newY -= 1
+            newY -= step
         elif event.keysym == 'Down':
-            newY += 1
+            newY += step
         
-        stickmanFrames.editNode(actualFrame, nodeIndex, newX, newY)
-        updateDraw()
+        # A run of nudges of the same node is undone at once
+        stickmanFrames.editNode(actualFrame, nodeIndex, newX, newY, merge=True)
+        renderScheduler.requestDraw()
 
 # Paints green the selected button and sets stickyMode according
 def setStickyMode(mode):
@@ -234,6 +606,8 @@ def setStickyMode(mode):
     addEdgeButton.configure(bg='white')
     addCircleButton.configure(bg='white')
     deleteNodeButton.configure(bg='white')
+    selectButton.configure(bg='white')
+    editEdgeButton.configure(bg='white')
     if stickyMode == ADD_NODE:
         addNodeButton.configure(bg='green')
     elif stickyMode == EDIT_NODE:
@@ -244,9 +618,14 @@ def setStickyMode(mode):
         addEdgeButton.configure(bg='green')
     elif stickyMode == ADD_CIRCLE:
         addCircleButton.configure(bg='green')
+    elif stickyMode == SELECT_NODES:
+        selectButton.configure(bg='green')
+    elif stickyMode == EDIT_EDGE:
+        editEdgeButton.configure(bg='green')
     
     stickmanFrames.unselectNodes(actualFrame)
-    updateDraw()
+    stickmanFrames.unselectEdge(actualFrame)
+    renderScheduler.requestDraw()
 
 # Tells if frames should repeat draw or not.
 # Changes from true to false and vice-versa everytime the button is clicked
@@ -261,8 +640,156 @@ def toggleRepeat():
     stickmanFrames.newByCopy = repeatButton
 
 def interpolate():
-    stickmanFrames.interpolate()
+    stickmanFrames.interpolate(interpolationMode.get())
+    renderScheduler.requestFrame()
+
+# Resample the animation in time. The user enters a new fps (like 30) or a
+# speed curve as frame:speed pairs (like 0:1, 48:0.5)
+def retime():
+    text = askstring('Retime', 'New fps, or speed curve (frame:speed, ...):',
+                     initialvalue='%g' % video.fps)
+    if text is None:
+        return
+    
+    try:
+        if ':' in text:
+            points = [point.split(':') for point in text.split(',')]
+            speedCurve = [(float(frame), float(speed)) for frame, speed in points]
+            stickmanFrames.retime(1, speedCurve, interpolationMode.get())
+        else:
+            fps = video.fps if video.fps > 0 else 24
+            stickmanFrames.retime(fps / float(text), mode=interpolationMode.get())
+    except (ValueError, ZeroDivisionError):
+        statusText.set('Invalid retime: ' + text)
+        return
+    renderScheduler.requestFrame()
+
+# Move the nodes of the current frame forward with optical flow, up to a
+# frame chosen by the user. Tracking runs on a background thread. Clicking
+# track again while it runs cancels it
+def trackNodes():
+    global nodeTracker, trackedFrame
+    if nodeTracker is not None:
+        nodeTracker.cancel()
+        return
+    
+    frame = stickmanFrames.getFrame(actualFrame)
+    if len(frame) == 0 or actualFrame >= video.nFrames - 1:
+        return
+    
+    lastFrame = askinteger('Track nodes', 'Track nodes up to frame:',
+                           initialvalue=video.nFrames, minvalue=actualFrame+2,
+                           maxvalue=video.nFrames)
+    if lastFrame is None:
+        return
+    
+    # The frame is copied, so tracked positions go to the nodes and edges
+    # it had now, even if it is edited while tracking runs
+    trackedFrame = frame.copy()
+    points = [(node.x, node.y) for node in trackedFrame.nodes]
+    nodeTracker = NodeTracker(video, points, actualFrame, lastFrame-1)
+    nodeTracker.start()
+    trackButton.configure(text='Cancel')
+    checkTracker()
+
+# Report tracking progress and, once it is done, write all tracked positions
+# back to the animation at once
+def checkTracker():
+    global nodeTracker
+    if not nodeTracker.done:
+        statusText.set('Tracking frame %d/%d' % (nodeTracker.progress, nodeTracker.total()))
+        root.after(100, checkTracker)
+        return
+    
+    # First position is the source frame itself, which is left untouched
+    positions = nodeTracker.result()[1:]
+    stickmanFrames.setPositions(trackedFrame, nodeTracker.firstFrame+1, positions)
+    statusText.set('Tracked %d frames' % len(positions))
+    trackButton.configure(text='Track')
+    nodeTracker = trackedFrame = None
+    renderScheduler.requestFrame()
+
+
+# Create a new figure. New nodes go to it
+def newFigure():
+    name = askstring('New figure', 'Figure name:',
+                     initialvalue='Figure ' + str(len(stickmanFrames.figures)+1))
+    if name:
+        stickmanFrames.addFigure(name)
+        updateFigureMenu()
+
+# Move the selected nodes to the active figure (on the range, if set)
+def assignSelection():
+    selected = stickmanFrames.selectedNodes(actualFrame)
+    if len(selected) > 0:
+        stickmanFrames.assignFigure(actualFrame, selected,
+                                    stickmanFrames.activeFigure, rangeLast)
+        renderScheduler.requestFrame()
+
+# Show or hide the active figure. Hidden figures are not exported either
+def toggleFigureVisible():
+    figure = stickmanFrames.figures[stickmanFrames.activeFigure]
+    figure.visible = not figure.visible
+    stickmanFrames.unselectNodes(actualFrame)
+    onionSkin.invalidate()
+    updateFigureMenu()
+    renderScheduler.requestFrame()
+
+# Lock or unlock the active figure. Nodes of locked figures can't be selected
+def toggleFigureLocked():
+    figure = stickmanFrames.figures[stickmanFrames.activeFigure]
+    figure.locked = not figure.locked
+    stickmanFrames.unselectNodes(actualFrame)
+    updateFigureMenu()
+    renderScheduler.requestDraw()
+
+def setActiveFigure():
+    stickmanFrames.activeFigure = activeFigureName.get()
+    updateFigureMenu()
+
+# Fill the figure menu with the figures of the animation
+def updateFigureMenu():
+    figureMenu.delete(0, 'end')
+    figureMenu.add_command(label='New figure...', command=newFigure)
+    figureMenu.add_command(label='Move selection to active figure',
+                           command=assignSelection)
+    
+    figure = stickmanFrames.figures[stickmanFrames.activeFigure]
+    figureMenu.add_command(label='Show active figure' if not figure.visible
+                           else 'Hide active figure', command=toggleFigureVisible)
+    figureMenu.add_command(label='Unlock active figure' if figure.locked
+                           else 'Lock active figure', command=toggleFigureLocked)
+    figureMenu.add_separator()
+    
+    activeFigureName.set(stickmanFrames.activeFigure)
+    for name, figure in stickmanFrames.figures.items():
+        label = name
+        if not figure.visible:
+            label += ' (hidden)'
+        if figure.locked:
+            label += ' (locked)'
+        figureMenu.add_radiobutton(label=label, value=name, variable=activeFigureName,
+                                   command=setActiveFigure)
 
+# Keep caches within the memory budget and show what each one uses. Runs
+# every second, adding up sizes is too slow to do on each render
+def checkMemory(repeat = True):
+    memoryManager.enforce()
+    memoryText.set('Memory: ' + memoryManager.describe())
+    if repeat:
+        root.after(1000, checkMemory)
+
+# Undo or redo the last operation on the animation. Frames around may have
+# changed too (onion skin), so the background is composed again
+def undo(event = None):
+    if history.undo():
+        stickmanFrames.unselectNodes(actualFrame)
+        renderScheduler.requestFrame()
+
+def redo(event = None):
+    if history.redo():
+        stickmanFrames.unselectNodes(actualFrame)
+        renderScheduler.requestFrame()
 
 # Opens save dialog and tries to save animation and resource location.
 # Notice that if video source is moved, an error will occur
@@ -291,7 +818,16 @@ def loadDialog(event = None):
     try:
         with open(path, 'rb') as f:
             stickmanFrames, videoPath = pickle.load(f)
+            memoryManager.register('Animation', stickmanFrames.nBytes)
+            history.clear()
+            stickmanFrames.history = history
+            updateFigureMenu()
             video = VideoProcessing(videoPath)
+            configureVideo(video)
+            # Old projects kept nodes as seen on the default 800 pixels view
+            if not stickmanFrames.sourceCoordinates:
+                stickmanFrames.toSourceCoordinates(ViewTransform(800 / video.sourceWidth))
+            stickmanFrames.setResolution(video.sourceWidth, video.sourceHeight)
             setFrame(0)
     except:
         print('Erro ao abrir arquivo')
@@ -337,31 +873,93 @@ def loadVideo(event = None, askUser = True):
         # Update path
         videoPath = path
         video = VideoProcessing(videoPath)
+        configureVideo(video)
+        stickmanFrames.setResolution(video.sourceWidth, video.sourceHeight)
         setFrame(0)
 
 # Use the export animation facility to export our animation
 def exportAnimation(event = None):
     folderPath = askdirectory()
-    if folderPath != '':
-        stickmanFrames.exportAnimation(folderPath, lineThickness, exportColor)
+    if folderPath == '':
+        return
+    # Images are exported at the video resolution unless asked otherwise
+    width = askinteger('Export animation', 'Image width:',
+                       initialvalue=stickmanFrames.imgWidth, minvalue=16)
+    if width is None:
+        return
+    # Drawing quality comes from the performance profile
+    engine = RenderEngine(antialias=exportAntialias, supersample=exportSupersample)
+    
+    # Each worker keeps the buffers of one image. They come out of the
+    # memory budget: caches are freed for them and, if they still don't
+    # fit, fewer images are drawn at once
+    imageBytes = engine.nBytes(*stickmanFrames.exportSize(width))
+    memoryManager.register('Export', lambda: exportWorkers * imageBytes)
+    memoryManager.enforce()
+    free = memoryManager.budget - memoryManager.total() + exportWorkers * imageBytes
+    workers = max(min(exportWorkers, free // imageBytes), 1)
+    memoryManager.register('Export', lambda: workers * imageBytes)
+    try:
+        stickmanFrames.exportAnimation(folderPath, lineThickness, exportColor, width,
+                                       engine=engine, workers=workers,
+                                       compression=pngCompression)
+    finally:
+        memoryManager.unregister('Export')
+        checkMemory(repeat=False)
+
+# File types of pose data (see poseData)
+poseDataTypes = (('NumPy arrays', '.npz'), ('CSV tables', '.csv'),
+                 ('JSON Lines', '.jsonl'))
+
+# Write node positions and edges of every frame as tables
+def exportPoseData():
+    path = asksaveasfilename(defaultextension = '.npz', filetypes=poseDataTypes)
+    if path == '':
+        return
+    try:
+        poseData.save(stickmanFrames, path)
+    except (OSError, ValueError):
+        print('Erro ao exportar dados')
+
+# Replace the animation by one read from pose data. The video is kept
+def importPoseData():
+    global stickmanFrames
+    path = askopenfilename(defaultextension = '.npz', filetypes=poseDataTypes)
+    if path == '':
+        return
+    try:
+        loaded = poseData.load(path)
+    except (OSError, ValueError, KeyError):
+        print('Erro ao importar dados')
+        return
+    stickmanFrames = loaded
+    memoryManager.register('Animation', stickmanFrames.nBytes)
+    history.clear()
+    stickmanFrames.history = history
+    stickmanFrames.setResolution(video.sourceWidth, video.sourceHeight)
+    updateFigureMenu()
+    onionSkin.invalidate()
+    setFrame(0)
 
 # Instance tk window
 root = tk.Tk()
 root.iconbitmap('stickmanAnimator.ico')
 
-# Bind special keys and shortcuts
-root.bind('<Key>', keyboardInput)
-root.bind('<MouseWheel>', mouseWheelEvent)
-root.bind("<Button-1>", mouseClick)
-root.bind("<Left>", moveNode)
-root.bind("<Right>", moveNode)
-root.bind("<Up>", moveNode)
-root.bind("<Down>", moveNode)
-root.bind("<Control-s>", saveDialog)
-root.bind("<Control-S>", saveDialog)
-root.bind("<Control-o>", loadDialog)
-root.bind("<Control-O>", loadVideo)
-root.bind("<Control-e>", exportAnimation)
+# Every input event goes through the scheduler, which renders at most once
+# per frame interval
+renderScheduler = RenderScheduler(root, render, targetFps = 60)
+
+# Menu bar with the figures of the animation
+menuBar = tk.Menu(root)
+figureMenu = tk.Menu(menuBar, tearoff=0)
+menuBar.add_cascade(label='Figures', menu=figureMenu)
+dataMenu = tk.Menu(menuBar, tearoff=0)
+dataMenu.add_command(label='Export pose data...', command=exportPoseData)
+dataMenu.add_command(label='Import pose data...', command=importPoseData)
+# Enabled at startup, once there is an animation
+menuBar.add_cascade(label='Data', menu=dataMenu, state='disabled')
+root.config(menu=menuBar)
+activeFigureName = tk.StringVar()
 
 # Create top bar
 loadVideoButton = tk.Button(root, text='Load video or images', command=loadVideo)
@@ -377,8 +975,10 @@ saveProjectButton.grid(row = 0, column = 8, columnspan = 4, sticky='we')
 exportAnimButton.grid(row = 0, column = 12, columnspan = 4, sticky='we')
 frameConfigButton.grid(row = 0, column = 16, columnspan = 4, sticky='we')
 
+# Canvas holding the video frame and the drawing above it
+imCanvas = FigureCanvas(root, width=frameSize[1], height=frameSize[0])
+
 # Create entry widget for holding frame number
-imLabel = tk.Label(root)
 entryText = tk.StringVar()
 entryFrame = tk.Entry(root, textvariable=entryText, width=6, justify='center')
 entryText.set('1')
@@ -387,6 +987,7 @@ entryText.set('1')
 buttonOk = tk.Button(root, text='ok', command=entryCallback)
 buttonPr = tk.Button(root, text='<<', command=previousFrame)
 buttonNe = tk.Button(root, text='>>', command=nextFrame)
+playButton = tk.Button(root, text='Play', command=togglePlay)
 
 # Create node manipulation taskbar
 addNodeButton     = tk.Button(root, text='Add', command=lambda:setStickyMode(ADD_NODE))
@@ -394,11 +995,21 @@ editNodeButton    = tk.Button(root, text='Edit', command=lambda:setStickyMode(ED
 deleteNodeButton  = tk.Button(root, text='Delete', command=lambda:setStickyMode(DELETE_NODE))
 addEdgeButton     = tk.Button(root, text='Line', command=lambda:setStickyMode(ADD_LINE))
 addCircleButton   = tk.Button(root, text='Circle', command=lambda:setStickyMode(ADD_CIRCLE))
+selectButton      = tk.Button(root, text='Select', command=lambda:setStickyMode(SELECT_NODES))
+editEdgeButton    = tk.Button(root, text='Edge', command=lambda:setStickyMode(EDIT_EDGE))
+rangeButton       = tk.Button(root, text='Range', command=toggleRange)
 repeatButton      = tk.Button(root, text='Repeat', relief='sunken', command=toggleRepeat)
 interpolateButton = tk.Button(root, text='Insert', command=interpolate)
+retimeButton      = tk.Button(root, text='Retime', command=retime)
+
+trackButton       = tk.Button(root, text='Track', command=trackNodes)
+
+# How Insert fills the gaps between frames. The menu is filled at startup
+interpolationMode = tk.StringVar()
+interpolationMenu = tk.OptionMenu(root, interpolationMode, '')
 
 # Our image covers the whole width
-imLabel.grid(row=1, column=0, columnspan=20)
+imCanvas.grid(row=1, column=0, columnspan=20)
 
 # Frame text
 frameLabel = tk.Label(root, text = 'Frame:')
@@ -409,29 +1020,135 @@ entryFrame.grid(row=2, column = 2, sticky='we')
 buttonOk.grid(row=2, column = 3, sticky='we')
 buttonPr.grid(row=2, column = 1, sticky='we')
 buttonNe.grid(row=2, column = 4, sticky='we')
+playButton.grid(row=2, column = 5, sticky='we')
 
 # Node text
 nodeLabel = tk.Label(root, text = 'Nodes:')
-nodeLabel.grid(row=2, column=7, sticky='e')
+nodeLabel.grid(row=2, column=6, sticky='e')
 
 # Place node manipulation widgets
+editEdgeButton.grid(row=2, column = 7, sticky='we')
 addNodeButton.grid(row=2, column = 8, sticky='we')
 editNodeButton.grid(row=2, column = 9, sticky='we')
 deleteNodeButton.grid(row=2, column = 10, sticky='we')
 addEdgeButton.grid(row=2, column = 11, sticky='we')
 addCircleButton.grid(row=2, column = 12, sticky='we')
+selectButton.grid(row=2, column = 13, sticky='we')
+rangeButton.grid(row=2, column = 14, sticky='we')
 
 # Buttons for control of repetition and interpolation
+retimeButton.grid(row=2, column = 15, sticky='we')
+interpolationMenu.grid(row=2, column = 16, sticky='we')
+trackButton.grid(row=2, column = 17, sticky='we')
 repeatButton.grid(row=2, column = 18, sticky='we')
 interpolateButton.grid(row=2, column = 19, sticky='we')
 
+# Status bar, used to report playback speed and long operations
+statusText = tk.StringVar()
+statusLabel = tk.Label(root, textvariable=statusText, anchor='w')
+statusLabel.grid(row=3, column=0, columnspan=10, sticky='we')
+
+# Memory used by each cache (see checkMemory)
+memoryText = tk.StringVar()
+memoryLabel = tk.Label(root, textvariable=memoryText, anchor='e')
+memoryLabel.grid(row=3, column=10, columnspan=10, sticky='we')
+
 # Set uniform for all columns
 for i in range(20):
     root.grid_columnconfigure(i, weight=1, uniform="a")
 root.grid_rowconfigure(1, weight=1)
 
-# Positionate on first frame and set ADD_NODE as default
-setFrame(0)
-setStickyMode(ADD_NODE)
+# Bind special keys and shortcuts. Done only at startup, so no input comes
+# before the animation exists
+def bindKeys():
+    root.bind('<Key>', keyboardInput)
+    root.bind('<MouseWheel>', mouseWheelEvent)
+    root.bind("<Button-1>", mouseClick)
+    root.bind("<B1-Motion>", mouseDrag)
+    root.bind("<ButtonRelease-1>", mouseRelease)
+    root.bind("<Delete>", deleteSelection)
+    root.bind("<Left>", moveNode)
+    root.bind("<Right>", moveNode)
+    root.bind("<Up>", moveNode)
+    root.bind("<Down>", moveNode)
+    root.bind("<Control-s>", saveDialog)
+    root.bind("<Control-S>", saveDialog)
+    root.bind("<Control-o>", loadDialog)
+    root.bind("<Control-O>", loadVideo)
+    root.bind("<Control-e>", exportAnimation)
+    root.bind("<Control-z>", undo)
+    root.bind("<Control-y>", redo)
+    root.bind("<Control-Z>", redo)
+
+# Enable or disable every button (they are disabled while starting)
+def setButtonsState(state):
+    for widget in root.winfo_children():
+        if isinstance(widget, (tk.Button, tk.OptionMenu)):
+            widget.configure(state=state)
+
+# Wait for the loading thread, then create the animation and show the
+# splash video. Positionate on first frame and set ADD_NODE as default
+def startup():
+    global video, stickmanFrames, onionSkin
+    if startupThread.is_alive():
+        root.after(10, startup)
+        return
+    if isinstance(startupResult, Exception):
+        raise startupResult
+    
+    video = startupResult
+    configureVideo(video)
+    stickmanFrames = StickmanFrames()
+    stickmanFrames.setResolution(video.sourceWidth, video.sourceHeight)
+    stickmanFrames.history = history
+    onionSkin = OnionSkin(onionFrames, onionOpacity)
+    
+    # Caches cheaper to rebuild are freed first. Decoded frames come back
+    # from the video (registered by configureVideo), ghosts are drawn again,
+    # but undo steps are lost. The animation and the canvas are only
+    # reported. The video and animation are registered again when replaced
+    memoryManager.register('Onion', onionSkin.nBytes, onionSkin.evict, 1)
+    memoryManager.register('Undo', lambda: history.nBytes, history.shrink, 2)
+    memoryManager.register('Animation', stickmanFrames.nBytes)
+    memoryManager.register('Canvas', imCanvas.nBytes)
+    checkMemory()
+    
+    menu = interpolationMenu['menu']
+    menu.delete(0, 'end')
+    for mode in INTERPOLATION_MODES:
+        menu.add_command(label=mode, command=tk._setit(interpolationMode, mode))
+    interpolationMode.set(INTERPOLATION_MODES[0])
+    updateFigureMenu()
+    
+    bindKeys()
+    setButtonsState('normal')
+    menuBar.entryconfigure('Data', state='normal')
+    statusText.set('')
+    setFrame(0)
+    setStickyMode(ADD_NODE)
+    
+    # The benchmark ends once the first frame is shown, failing if the
+    # window took longer than the budget
+    if startupBudget is not None:
+        renderScheduler.flush()
+        root.update()
+        reportStartup('First frame shown')
+        print('Budget for the window: %d ms' % startupBudget)
+        root.destroy()
+        sys.exit(0 if windowTime <= startupBudget else 1)
+
+# Print and return the milliseconds since the script started
+def reportStartup(event):
+    elapsed = (time.perf_counter() - startTime) * 1000
+    print('%s in %.0f ms' % (event, elapsed))
+    return elapsed
+
+# The window is shown right away, everything else comes after
+setButtonsState('disabled')
+statusText.set('Loading...')
+root.update()
+if startupBudget is not None:
+    windowTime = reportStartup('Window shown')
+startup()
 
 root.mainloop()
\ No newline at end of file
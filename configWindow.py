@@ -1,6 +1,20 @@
 import tkinter as tk
 
+from settings import LIMITS
 from tkinter.ttk import Separator
+from tkinter.simpledialog import askstring as askstring
+
+# Performance settings shown on the window: key (see settings.py), label,
+# minimum and maximum
+PERFORMANCE_FIELDS = tuple((key, label) + LIMITS[key] for key, label in
+                           (('decodeCacheSize', 'Decode cache (frames)'),
+                            ('prefetchDepth', 'Prefetch depth (frames)'),
+                            ('exportWorkers', 'Export workers'),
+                            ('previewDownscale', 'Preview downscale'),
+                            ('pngCompression', 'PNG compression (0-9)'),
+                            ('memoryBudget', 'Memory budget (MB)'),
+                            ('exportAntialias', 'Export antialiasing (0-1)'),
+                            ('exportSupersample', 'Export supersampling')))
 
 # A modified entry widget that is capable of reseting its own value, detect
 # focus, and check for valid values
@@ -59,7 +73,9 @@ class IntEntry(tk.Entry):
 # This class shows a popup window to update the confguration variables
 class ConfigWindow(tk.Toplevel):
     def __init__(self, parent, nodeColor, lineColor, selectedColor,
-                 exportColor, lineThickness, frameJump, onClosing):
+                 exportColor, lineThickness, frameJump, onClosing,
+                 onionFrames = 0, onionOpacity = 40, profiles = None,
+                 profile = None):
         # Base class constructor
         tk.Toplevel.__init__(self, parent)
         self.parent = parent
@@ -97,17 +113,65 @@ class ConfigWindow(tk.Toplevel):
                                                    sticky='we', pady=3)
         
         self.lineThicknessLabel = tk.Label(self, text='Line thickness')
-        self.lineThicknessEntry = IntEntry(self, lineThickness, 200, width=4, justify='center')
+        self.lineThicknessEntry = IntEntry(self, initValue=lineThickness, width=4,
+                                           minValue=LIMITS['lineThickness'][0],
+                                           maxValue=LIMITS['lineThickness'][1],
+                                           justify='center')
         
         self.skipFramesLabel = tk.Label(self, text='Frame jump')
         self.skipFramesEntry = IntEntry(self, initValue=frameJump, width=4,
-                                        minValue=1, maxValue=24, justify='center')
+                                        minValue=LIMITS['frameJump'][0],
+                                        maxValue=LIMITS['frameJump'][1], justify='center')
+        
+        # Onion skin: how many frames before and after are shown as ghosts
+        # and how opaque the closest ghost is (in percent)
+        self.onionFramesLabel = tk.Label(self, text='Onion frames')
+        self.onionFramesEntry = IntEntry(self, initValue=onionFrames, width=4,
+                                         minValue=LIMITS['onionFrames'][0],
+                                         maxValue=LIMITS['onionFrames'][1],
+                                         justify='center')
+        
+        self.onionOpacityLabel = tk.Label(self, text='Onion opacity (%)')
+        self.onionOpacityEntry = IntEntry(self, initValue=onionOpacity, width=4,
+                                          minValue=LIMITS['onionOpacity'][0],
+                                          maxValue=LIMITS['onionOpacity'][1],
+                                          justify='center')
         
         row += 1
         self.lineThicknessLabel.grid(row=row, column=0, columnspan=2, sticky='e')
         self.lineThicknessEntry.grid(row=row, column=2)
         self.skipFramesLabel.grid(row=row+1, column=0, columnspan=2, sticky='e')
         self.skipFramesEntry.grid(row=row+1, column=2)
+        self.onionFramesLabel.grid(row=row+2, column=0, columnspan=2, sticky='e')
+        self.onionFramesEntry.grid(row=row+2, column=2)
+        self.onionOpacityLabel.grid(row=row+3, column=0, columnspan=2, sticky='e')
+        self.onionOpacityEntry.grid(row=row+3, column=2)
+        
+        ### performance part. Settings come in named profiles (profiles is
+        # a dict of name -> settings), the one selected is used
+        self.profiles = {name: dict(values) for name, values in (profiles or {}).items()}
+        self.profileVar = tk.StringVar(value=profile)
+        self.performanceEntries = {}
+        self.shownProfile = profile
+        if profile in self.profiles:
+            row += 4
+            Separator(self, orient=tk.HORIZONTAL).grid(row=row, columnspan=4,
+                                                       sticky='we', pady=3)
+            tk.Label(self, text='Profile').grid(row=row+1, column=0, sticky='e')
+            self.profileMenu = tk.OptionMenu(self, self.profileVar, *self.profiles,
+                                             command=self.showProfile)
+            self.profileMenu.grid(row=row+1, column=1, columnspan=2, sticky='we')
+            tk.Button(self, text='Save as', command=self.saveProfile).grid(row=row+1,
+                                                                           column=3)
+            
+            values = self.profiles[profile]
+            for i, (key, label, minValue, maxValue) in enumerate(PERFORMANCE_FIELDS):
+                entry = IntEntry(self, initValue=values[key], width=6, minValue=minValue,
+                                 maxValue=maxValue, justify='center')
+                tk.Label(self, text=label).grid(row=row+2+i, column=0, columnspan=2,
+                                                sticky='e')
+                entry.grid(row=row+2+i, column=2)
+                self.performanceEntries[key] = entry
         
         self.resizable(False, False)
         
@@ -119,6 +183,11 @@ class ConfigWindow(tk.Toplevel):
                     entry.onFocusOut()
             self.lineThicknessEntry.onFocusOut()
             self.skipFramesEntry.onFocusOut()
+            self.onionFramesEntry.onFocusOut()
+            self.onionOpacityEntry.onFocusOut()
+            for entry in self.performanceEntries.values():
+                entry.onFocusOut()
+            self.storeProfile()
             
             # Call callback we created outside
             onClosing()
@@ -148,6 +217,53 @@ class ConfigWindow(tk.Toplevel):
     
     def getFrameJump(self):
         return int(self.skipFramesEntry.get())
+    
+    def getOnionFrames(self):
+        return int(self.onionFramesEntry.get())
+    
+    def getOnionOpacity(self):
+        return int(self.onionOpacityEntry.get())
+    
+    # Keep what is on the entries as the values of the profile shown
+    def storeProfile(self):
+        if len(self.performanceEntries) == 0:
+            return
+        values = self.profiles[self.shownProfile]
+        for key, entry in self.performanceEntries.items():
+            if entry.get() != '':
+                values[key] = int(entry.get())
+    
+    # Show the values of another profile. Changes to the one shown are kept
+    def showProfile(self, name):
+        self.storeProfile()
+        self.shownProfile = name
+        for key, entry in self.performanceEntries.items():
+            entry.set(str(self.profiles[name][key]))
+    
+    # Save the values on the entries as a new profile (or over an old one)
+    # and select it
+    def saveProfile(self):
+        name = askstring('Save profile', 'Profile name:', parent=self)
+        if name is None or name.strip() == '':
+            return
+        name = name.strip()
+        self.storeProfile()
+        self.profiles[name] = dict(self.profiles[self.shownProfile])
+        self.profileMenu['menu'].delete(0, 'end')
+        for profile in self.profiles:
+            self.profileMenu['menu'].add_command(
+                label=profile, command=tk._setit(self.profileVar, profile,
+                                                 self.showProfile))
+        self.profileVar.set(name)
+        self.shownProfile = name
+    
+    # Selected profile and the values of every profile, with any change
+    def getProfile(self):
+        return self.shownProfile
+    
+    def getProfiles(self):
+        self.storeProfile()
+        return self.profiles
         
 
 # The code below shows how this class works. We define some really simple
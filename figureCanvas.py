@@ -0,0 +1,166 @@
+import tkinter as tk
+
+# Convert an (R, G, B) tuple to a tk color string
+def tkColor(color):
+    return '#%02x%02x%02x' % tuple(int(c) for c in color)
+
+# A canvas that shows the video frame as a persistent image item and the
+# stickman as line and oval items. Drawing a figure only touches the items
+# whose node or edge changed since the last draw
+class FigureCanvas(tk.Canvas):
+    def __init__(self, master, width = 800, height = 600, **kwargs):
+        tk.Canvas.__init__(self, master, width=width, height=height, bg='black',
+                           highlightthickness=0, bd=0, **kwargs)
+
+        # Video frame. The PhotoImage is reused while the size doesn't change
+        self.backgroundImage = None
+        self.backgroundItem = self.create_image(0, 0, anchor='nw')
+
+        # For each node and edge we keep the item id and what was drawn, so
+        # we know what to update on the next draw
+        self.nodeItems = []
+        self.edgeItems = []
+        
+        # Rectangle shown while selecting nodes by dragging the mouse
+        self.rubberBand = self.create_rectangle(0, 0, 0, 0, outline='white',
+                                                dash=(4, 4), state='hidden')
+
+    # Replace the video frame (a RGB numpy image). PIL is imported here, so
+    # the canvas can be shown before it is loaded
+    def setBackground(self, image):
+        if image is None:
+            return
+        from PIL import Image
+        from PIL import ImageTk
+        image = Image.fromarray(image)
+        if self.backgroundImage is not None and\
+           self.backgroundImage.width() == image.width and\
+           self.backgroundImage.height() == image.height:
+            self.backgroundImage.paste(image)
+        else:
+            self.backgroundImage = ImageTk.PhotoImage(image)
+            self.itemconfigure(self.backgroundItem, image=self.backgroundImage)
+
+    # Memory used by the video frame image (tk keeps 4 bytes per pixel)
+    def nBytes(self):
+        if self.backgroundImage is None:
+            return 0
+        return 4 * self.backgroundImage.width() * self.backgroundImage.height()
+
+    # Draw a stickman frame (see stickmanFrames.Frame) above the background.
+    # transform maps node coordinates to the canvas. Figures in hidden, and
+    # figures outside the canvas, are not drawn
+    def drawFigure(self, frame, transform, lineThickness = 10,
+                   lineColor = (0, 255, 0), nodeColor = (0, 255, 0),
+                   selectedColor = (255, 0, 0), drawNodes = True, hidden = ()):
+        lineColor = tkColor(lineColor)
+        area = transform.visibleArea(int(self['width']), int(self['height']))
+        margin = transform.lengthToSource(lineThickness)
+        nodeMask, edgeMask = frame.visibleMasks(area, margin, hidden)
+        
+        # All nodes are mapped to the canvas at once
+        points = transform.toScreen(frame.positions()).tolist()
+
+        # Edges first, so nodes stay on top of them
+        for i, (id1, id2, edgeType) in enumerate(frame.edges):
+            # Items not drawn are hidden, their state is None
+            state = None
+            if edgeMask[i]:
+                color = tkColor(selectedColor) if i == frame.selectedEdge else lineColor
+                (x1, y1), (x2, y2) = points[id1], points[id2]
+                if edgeType == 'circle':
+                    radius = ((x1-x2)**2 + (y1-y2)**2) ** 0.5 / 2
+                    centerX, centerY = (x1 + x2) / 2, (y1 + y2) / 2
+                    coords = (centerX - radius, centerY - radius,
+                              centerX + radius, centerY + radius)
+                else:
+                    coords = (x1, y1, x2, y2)
+                state = (edgeType, coords, color, lineThickness)
+
+            if i < len(self.edgeItems):
+                item, oldState = self.edgeItems[i]
+                if oldState == state:
+                    continue
+                if state is None:
+                    self.itemconfigure(item, state='hidden')
+                # Line and oval items can not be converted, so replace it
+                elif oldState is None or oldState[0] != edgeType:
+                    self.delete(item)
+                    item = self.createEdge(state)
+                else:
+                    self.updateEdge(item, oldState, state)
+                self.edgeItems[i] = (item, state)
+            elif state is None:
+                self.edgeItems.append((self.create_line(0, 0, 0, 0, state='hidden'), None))
+            else:
+                self.edgeItems.append((self.createEdge(state), state))
+
+        # Remove items of edges that do not exist anymore
+        self.trim(self.edgeItems, len(frame.edges))
+
+        # Now the nodes, if requested
+        nNodes = len(frame.nodes) if drawNodes else 0
+        for i in range(nNodes):
+            state = None
+            if nodeMask[i]:
+                x, y = points[i]
+                color = tkColor(selectedColor if frame.nodes[i].isSelected else nodeColor)
+                coords = (x - lineThickness, y - lineThickness,
+                          x + lineThickness, y + lineThickness)
+                state = (coords, color)
+
+            if i < len(self.nodeItems):
+                item, oldState = self.nodeItems[i]
+                if oldState == state:
+                    continue
+                if state is None:
+                    self.itemconfigure(item, state='hidden')
+                else:
+                    if oldState is None:
+                        self.itemconfigure(item, state='normal')
+                    if oldState is None or oldState[0] != state[0]:
+                        self.coords(item, *state[0])
+                    if oldState is None or oldState[1] != state[1]:
+                        self.itemconfigure(item, fill=state[1])
+                self.nodeItems[i] = (item, state)
+            else:
+                coords, color = state if state is not None else ((0, 0, 0, 0), '')
+                item = self.create_oval(*coords, fill=color, outline='', tags='node',
+                                        state='normal' if state is not None else 'hidden')
+                self.nodeItems.append((item, state))
+
+        self.trim(self.nodeItems, nNodes)
+        self.tag_raise('node')
+
+    # Show the selection rectangle from (x1, y1) to (x2, y2)
+    def showRubberBand(self, x1, y1, x2, y2):
+        self.coords(self.rubberBand, x1, y1, x2, y2)
+        self.itemconfigure(self.rubberBand, state='normal')
+        self.tag_raise(self.rubberBand)
+    
+    def hideRubberBand(self):
+        self.itemconfigure(self.rubberBand, state='hidden')
+    
+    # Create a line or oval item for an edge state
+    def createEdge(self, state):
+        edgeType, coords, color, thickness = state
+        if edgeType == 'circle':
+            return self.create_oval(*coords, fill=color, outline='', tags='edge')
+        return self.create_line(*coords, fill=color, width=thickness,
+                                capstyle='round', tags='edge')
+
+    # Update only what changed on an existing edge item
+    def updateEdge(self, item, oldState, state):
+        edgeType, coords, color, thickness = state
+        if oldState[1] != coords:
+            self.coords(item, *coords)
+        if oldState[2] != color:
+            self.itemconfigure(item, fill=color)
+        if oldState[3] != thickness and edgeType != 'circle':
+            self.itemconfigure(item, width=thickness)
+
+    # Delete items beyond size
+    def trim(self, items, size):
+        for item, _ in items[size:]:
+            self.delete(item)
+        del items[size:]
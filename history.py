@@ -0,0 +1,142 @@
+import collections
+import contextlib
+
+# Rough memory kept by a delta itself (the closures and this object)
+DELTA_BYTES = 256
+
+# One reversible operation. undo and redo are functions without arguments.
+# nBytes estimates the memory kept alive by them
+class Delta:
+    def __init__(self, undo, redo, nBytes = 0, mergeKey = None):
+        self.undo = undo
+        self.redo = redo
+        self.nBytes = nBytes + DELTA_BYTES
+        self.mergeKey = mergeKey
+
+# Several deltas undone and redone as a single step
+class DeltaGroup:
+    def __init__(self):
+        self.deltas = []
+        self.nBytes = DELTA_BYTES
+        self.mergeKey = None
+
+    def append(self, delta):
+        self.deltas.append(delta)
+        self.nBytes += delta.nBytes
+
+    def undo(self):
+        for delta in reversed(self.deltas):
+            delta.undo()
+
+    def redo(self):
+        for delta in self.deltas:
+            delta.redo()
+
+# Undo/redo stacks. The memory of all recorded deltas is capped at maxBytes
+# and the oldest ones are forgotten first
+class History:
+    def __init__(self, maxBytes = 16 * 2**20):
+        self.maxBytes = maxBytes
+        self.undoStack = collections.deque()
+        self.redoStack = []
+        self.nBytes = 0
+
+        # While paused (undoing, redoing or inside a compound operation)
+        # nothing is recorded
+        self.pauseLevel = 0
+        # Groups being recorded. Deltas go to the innermost one
+        self.openGroups = []
+
+    def __len__(self):
+        return len(self.undoStack)
+
+    # Forget everything
+    def clear(self):
+        self.undoStack.clear()
+        self.redoStack = []
+        self.nBytes = 0
+
+    # Record an operation. Consecutive deltas with the same mergeKey (like
+    # many small moves of one node) become one step that keeps the first undo
+    def record(self, undo, redo, nBytes = 0, mergeKey = None):
+        if self.pauseLevel > 0:
+            return
+
+        delta = Delta(undo, redo, nBytes, mergeKey)
+        if len(self.openGroups) > 0:
+            self.openGroups[-1].append(delta)
+            return
+
+        if mergeKey is not None and len(self.redoStack) == 0 and\
+           len(self.undoStack) > 0 and self.undoStack[-1].mergeKey == mergeKey:
+            self.undoStack[-1].redo = redo
+            return
+        self.push(delta)
+
+    # Add a step to the undo stack. A new step makes redo impossible
+    def push(self, delta):
+        for old in self.redoStack:
+            self.nBytes -= old.nBytes
+        self.redoStack = []
+
+        self.undoStack.append(delta)
+        self.nBytes += delta.nBytes
+        self.evict()
+
+    # Forget the oldest steps until we are within budget
+    def evict(self):
+        while self.nBytes > self.maxBytes and len(self.undoStack) > 0:
+            self.nBytes -= self.undoStack.popleft().nBytes
+
+    # Forget the oldest steps until nBytes are freed (to make room for other
+    # things). Returns the bytes freed
+    def shrink(self, nBytes):
+        freed = 0
+        while freed < nBytes and len(self.undoStack) > 0:
+            freed += self.undoStack.popleft().nBytes
+        self.nBytes -= freed
+        return freed
+
+    # Everything recorded inside a with block is one step
+    @contextlib.contextmanager
+    def group(self):
+        group = DeltaGroup()
+        self.openGroups.append(group)
+        try:
+            yield group
+        finally:
+            self.openGroups.pop()
+            if len(group.deltas) > 0:
+                if len(self.openGroups) > 0:
+                    self.openGroups[-1].append(group)
+                else:
+                    self.push(group)
+
+    # Nothing is recorded inside a with block
+    @contextlib.contextmanager
+    def pause(self):
+        self.pauseLevel += 1
+        try:
+            yield
+        finally:
+            self.pauseLevel -= 1
+
+    # Undo the last step. Returns False if there was nothing to undo
+    def undo(self):
+        if len(self.undoStack) == 0:
+            return False
+        delta = self.undoStack.pop()
+        with self.pause():
+            delta.undo()
+        self.redoStack.append(delta)
+        return True
+
+    # Redo the last undone step. Returns False if there was nothing to redo
+    def redo(self):
+        if len(self.redoStack) == 0:
+            return False
+        delta = self.redoStack.pop()
+        with self.pause():
+            delta.redo()
+        self.undoStack.append(delta)
+        return True
@@ -0,0 +1,66 @@
+# Keeps the memory of every cache and buffer of the editor under a single
+# budget. Components register a function that returns their size in bytes
+# and, if they can free memory, a function that frees about the bytes it is
+# given and returns how many it freed. Nothing is measured by itself, each
+# component knows what it keeps
+class MemoryManager:
+    def __init__(self, budget = 1024 * 2**20):
+        self.budget = budget
+        # name -> (size, evict, priority), in registration order
+        self.components = {}
+
+    # Components with lower priority are evicted first. Those without evict
+    # are only reported. Registering a name again replaces the component
+    def register(self, name, size, evict = None, priority = 0):
+        self.components[name] = (size, evict, priority)
+
+    def unregister(self, name):
+        self.components.pop(name, None)
+
+    # Bytes used by each component, by name
+    def usage(self):
+        return {name: size() for name, (size, evict, priority) in self.components.items()}
+
+    def total(self):
+        return sum(self.usage().values())
+
+    # Free memory until everything fits in the budget, cheapest to rebuild
+    # first. Returns the bytes freed
+    def enforce(self):
+        excess = self.total() - self.budget
+        freed = 0
+        evictable = [(priority, name) for name, (size, evict, priority)
+                     in self.components.items() if evict is not None]
+        for priority, name in sorted(evictable):
+            if excess <= 0:
+                break
+            released = self.components[name][1](excess)
+            excess -= released
+            freed += released
+        return freed
+
+    # One line with the usage of each component and the total, in MB
+    def describe(self):
+        usage = self.usage()
+        parts = ['%s %.0f' % (name, size / 2**20) for name, size in usage.items()]
+        return '%s | %.0f/%.0f MB' % (', '.join(parts), sum(usage.values()) / 2**20,
+                                      self.budget / 2**20)
+
+if __name__ == '__main__':
+    # Two caches of 100 items of 1 MB each and a budget of 150 MB
+    caches = {'first': [2**20] * 100, 'second': [2**20] * 100}
+
+    def evictFrom(cache):
+        def evict(nBytes):
+            freed = 0
+            while freed < nBytes and len(cache) > 0:
+                freed += cache.pop(0)
+            return freed
+        return evict
+
+    manager = MemoryManager(150 * 2**20)
+    manager.register('first', lambda: sum(caches['first']), evictFrom(caches['first']), 1)
+    manager.register('second', lambda: sum(caches['second']), evictFrom(caches['second']), 0)
+    print(manager.describe())
+    print('Freed %.0f MB' % (manager.enforce() / 2**20))
+    print(manager.describe())
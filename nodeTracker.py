@@ -0,0 +1,78 @@
+import cv2
+import threading
+import numpy as np
+
+from videoProcessing import VideoProcessing
+
+# Tracks a set of points through a range of video frames with pyramidal
+# Lucas-Kanade optical flow. All points are tracked in one call per pair of
+# frames. It runs on its own thread and its own video capture, so the
+# interface keeps responding. The interface polls progress and done
+class NodeTracker(threading.Thread):
+    def __init__(self, video, points, firstFrame, lastFrame):
+        threading.Thread.__init__(self, daemon=True)
+        # video is the VideoProcessing shown on screen. We open the same file
+        # again and track on the frames as decoded, so the points are in
+        # source video coordinates whatever the zoom on screen
+        self.path = video.path
+
+        self.points = np.array(points, dtype=np.float32).reshape(-1, 1, 2)
+        self.firstFrame = firstFrame
+        self.lastFrame = min(lastFrame, video.nFrames - 1)
+
+        # positions[i] holds the points on frame firstFrame + i
+        self.positions = np.zeros((self.lastFrame - firstFrame + 1, len(points), 2),
+                                  dtype=np.float32)
+        self.progress = 0
+        self.done = False
+        self.cancelled = False
+
+    # Number of frames to process
+    def total(self):
+        return len(self.positions)
+
+    # Ask the thread to stop. Frames tracked so far are kept
+    def cancel(self):
+        self.cancelled = True
+
+    def run(self):
+        try:
+            self.track()
+        finally:
+            self.done = True
+
+    def track(self):
+        video = VideoProcessing(self.path)
+
+        # First frame holds the points as they were placed by the user
+        frame = video.decode(self.firstFrame)
+        if frame is None:
+            return
+        previous = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        points = self.points
+        self.positions[0] = points.reshape(-1, 2)
+        self.progress = 1
+
+        # Frames are read in sequence, so the video is never seeked again
+        for i in range(1, self.total()):
+            if self.cancelled:
+                break
+            frame = video.decode(self.firstFrame + i)
+            if frame is None:
+                break
+            current = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+
+            tracked, status, _ = cv2.calcOpticalFlowPyrLK(previous, current, points,
+                                                          None, winSize=(21, 21),
+                                                          maxLevel=3)
+            # Points that were lost stay where they were
+            lost = status.reshape(-1) == 0
+            tracked[lost] = points[lost]
+
+            self.positions[i] = tracked.reshape(-1, 2)
+            previous, points = current, tracked
+            self.progress = i + 1
+
+    # Tracked positions, only for the frames already processed
+    def result(self):
+        return self.positions[:self.progress]
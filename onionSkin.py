@@ -0,0 +1,120 @@
+import numpy as np
+
+# Onion skin shows the previous and next frames as faded ghosts behind the
+# current one. Each ghost is drawn once into a RGBA layer and kept until its
+# frame changes. All visible ghosts are blended in a single numpy operation
+class OnionSkin:
+    def __init__(self, nFrames = 0, opacity = 40,
+                 previousColor = (255, 64, 64), nextColor = (64, 128, 255)):
+        # Number of ghosts on each side and opacity (0-100) of the closest one
+        self.nFrames = nFrames
+        self.opacity = opacity
+        self.previousColor = previousColor
+        self.nextColor = nextColor
+
+        # frameIndex -> (frame, key, layer, box). frame is the Frame object
+        # drawn, so replaced frames are never confused with the cached ones.
+        # box is the region of the layer where something was drawn
+        self.layers = {}
+
+    # Drop every cached layer
+    def invalidate(self):
+        self.layers = {}
+
+    # Memory used by cached layers
+    def nBytes(self):
+        return sum(layer.nbytes for frame, key, layer, box in self.layers.values())
+    
+    # Drop cached layers until nBytes are freed. Returns the bytes freed
+    def evict(self, nBytes):
+        freed = 0
+        for index in list(self.layers):
+            if freed >= nBytes:
+                break
+            freed += self.layers.pop(index)[2].nbytes
+        return freed
+
+    # Change settings. Layers are kept, they don't depend on the opacity
+    def configure(self, nFrames, opacity):
+        self.nFrames = nFrames
+        self.opacity = opacity
+
+    # Return the ghost layer of a frame and its drawn region, drawing it only
+    # if it is not cached or the frame changed since it was drawn
+    def getLayer(self, stickmanFrames, frameIndex, shape, color, lineThickness,
+                 transform):
+        frame = stickmanFrames.getFrame(frameIndex)
+        if len(frame) == 0:
+            return None, None
+
+        key = (frame.version, shape, color, lineThickness, transform.key())
+        cached = self.layers.get(frameIndex)
+        if cached is not None and cached[0] is frame and cached[1] == key:
+            return cached[2], cached[3]
+
+        # Alpha channel is 255 wherever the figure was drawn
+        layer = np.zeros((shape[0], shape[1], 4), dtype=np.uint8)
+        stickmanFrames.drawFigure(frameIndex, layer, lineThickness,
+                                  lineColor=tuple(color) + (255,), drawNodes=False,
+                                  transform=transform)
+        
+        # Rows and columns with some drawing, so blending can skip the rest
+        rows = np.flatnonzero(layer[:, :, 3].any(axis=1))
+        cols = np.flatnonzero(layer[:, :, 3].any(axis=0))
+        box = None
+        if len(rows) > 0:
+            box = (rows[0], rows[-1]+1, cols[0], cols[-1]+1)
+        
+        self.layers[frameIndex] = (frame, key, layer, box)
+        return layer, box
+
+    # Blend the ghosts of the frames around frameIndex over background, seen
+    # through transform (see viewTransform.ViewTransform)
+    def composite(self, background, stickmanFrames, frameIndex, transform,
+                  lineThickness = 10):
+        if self.nFrames <= 0 or self.opacity <= 0 or background is None:
+            return background
+
+        # Collect layers and their opacity. Farther frames are more faded
+        layers, weights, boxes = [], [], []
+        for distance in range(1, self.nFrames+1):
+            weight = self.opacity / 100 * (1 - (distance-1) / self.nFrames)
+            for index, color in ((frameIndex-distance, self.previousColor),
+                                 (frameIndex+distance, self.nextColor)):
+                if index < 0:
+                    continue
+                layer, box = self.getLayer(stickmanFrames, index, background.shape,
+                                           color, lineThickness, transform)
+                if box is not None:
+                    layers.append(layer)
+                    weights.append(weight)
+                    boxes.append(box)
+
+        # Forget layers too far from here, so the cache doesn't grow forever
+        window = 2 * self.nFrames
+        for index in list(self.layers):
+            if abs(index - frameIndex) > window:
+                del self.layers[index]
+
+        if len(layers) == 0:
+            return background
+
+        # Only the region covered by some ghost is blended
+        boxes = np.array(boxes)
+        y1, x1 = boxes[:, 0].min(), boxes[:, 2].min()
+        y2, x2 = boxes[:, 1].max(), boxes[:, 3].max()
+        
+        # Per pixel alpha of each ghost, shape (ghosts, height, width, 1)
+        layers = np.stack([layer[y1:y2, x1:x2] for layer in layers])
+        weights = np.array(weights, dtype=np.float32)[:, None, None, None]
+        alpha = layers[..., 3:] * (weights / 255)
+
+        # Ghosts are mixed by their alpha and laid over the background
+        keep = np.prod(1 - alpha, axis=0)
+        alphaSum = np.maximum(alpha.sum(axis=0), 1e-6)
+        ghosts = (layers[..., :3] * alpha).sum(axis=0) / alphaSum
+        
+        image = np.copy(background)
+        region = background[y1:y2, x1:x2] * keep + ghosts * (1 - keep)
+        image[y1:y2, x1:x2] = region.astype(np.uint8)
+        return image
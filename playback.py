@@ -0,0 +1,62 @@
+import time
+
+# Clock for real time playback. Frames are due at startFrame + elapsed * fps.
+# When decoding or drawing is too slow, the late frames are dropped instead of
+# making the animation fall behind
+class PlaybackClock:
+    def __init__(self, fps, startFrame = 0):
+        # Some videos report 0 fps, so we use a common default
+        self.fps = fps if fps > 0 else 24
+        self.startFrame = startFrame
+        self.startTime = time.perf_counter()
+
+        # Last frame returned and statistics
+        self.lastFrame = startFrame - 1
+        self.shownFrames = 0
+        self.droppedFrames = 0
+
+    # Frame that should be on screen now
+    def dueFrame(self):
+        elapsed = time.perf_counter() - self.startTime
+        return self.startFrame + int(elapsed * self.fps)
+
+    # Return the frame to be shown now, or None if it is too early for the
+    # next one. Frames skipped since the last call are counted as dropped
+    def nextFrame(self):
+        frameIndex = self.dueFrame()
+        if frameIndex <= self.lastFrame:
+            return None
+
+        self.droppedFrames += frameIndex - self.lastFrame - 1
+        self.lastFrame = frameIndex
+        self.shownFrames += 1
+        return frameIndex
+
+    # Milliseconds until the next frame is due
+    def delayToNext(self):
+        nextTime = self.startTime + (self.lastFrame + 1 - self.startFrame) / self.fps
+        return max(int((nextTime - time.perf_counter()) * 1000), 1)
+
+    # Frames per second actually shown on screen
+    def achievedFps(self):
+        elapsed = time.perf_counter() - self.startTime
+        if elapsed <= 0:
+            return 0
+        return self.shownFrames / elapsed
+
+    # Short text to report on the interface
+    def describe(self):
+        return '%.1f/%.1f fps, %d dropped' % (self.achievedFps(), self.fps,
+                                              self.droppedFrames)
+
+# Simulate a slow renderer to see frames being dropped
+if __name__ == '__main__':
+    clock = PlaybackClock(24)
+    while clock.lastFrame < 48:
+        frameIndex = clock.nextFrame()
+        if frameIndex is None:
+            time.sleep(clock.delayToNext() / 1000)
+            continue
+        # Pretend drawing takes 60ms (more than 1/24s)
+        time.sleep(0.06)
+    print('Played', clock.shownFrames, 'frames:', clock.describe())
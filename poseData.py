@@ -0,0 +1,298 @@
+import os
+import csv
+import json
+import zipfile
+import numpy as np
+
+from stickmanFrames import StickmanFrames, Frame, Node, Figure, Topology, DEFAULT_FIGURE
+
+# Pose data is the animation as plain tables, for tools outside the editor.
+# Nodes are one table with a row per node of every frame. Edges are kept by
+# topology, as frames share them (see stickmanFrames.Topology):
+#   .npz: one column per array, readable with numpy.load
+#     nodeOffsets (frames+1): nodes of frame i are rows nodeOffsets[i] to
+#                             nodeOffsets[i+1]
+#     x, y, figure: position and figure (index in figureNames) of each node
+#     frameTopology (frames): topology of each frame
+#     edgeOffsets (topologies+1), edgeNode1, edgeNode2, edgeCircle: edges of
+#                             each topology, like the nodes of each frame
+#     figureNames, figureVisible, figureLocked, resolution
+#   .csv: two files, name_nodes.csv (frame, node, x, y, figure) and
+#         name_edges.csv (frame, edge, node1, node2, type)
+#   .jsonl: a header line, then one line per frame with its nodes and edges
+# Everything is written a chunk (or a line) at a time, so memory does not grow with the
+# length of the animation
+
+# Nodes written at once, at most (a frame is never split)
+CHUNK_NODES = 65536
+
+EXTENSIONS = ('.npz', '.csv', '.jsonl')
+
+# Save stickmanFrames to path. The format is taken from the extension
+def save(stickmanFrames, path):
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.npz':
+        saveNpz(stickmanFrames, path)
+    elif extension == '.csv':
+        saveCsv(stickmanFrames, path)
+    elif extension == '.jsonl':
+        saveJsonLines(stickmanFrames, path)
+    else:
+        raise ValueError('Unknown pose data format: ' + extension)
+
+# Load a StickmanFrames saved by save
+def load(path):
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.npz':
+        return loadNpz(path)
+    if extension == '.csv':
+        return loadCsv(path)
+    if extension == '.jsonl':
+        return loadJsonLines(path)
+    raise ValueError('Unknown pose data format: ' + extension)
+
+# Groups of consecutive frames with about CHUNK_NODES nodes, as ranges.
+# sizes is the number of nodes of each frame
+def frameChunks(sizes):
+    first, nNodes = 0, 0
+    for i, size in enumerate(sizes):
+        nNodes += size
+        if nNodes >= CHUNK_NODES:
+            yield range(first, i+1)
+            first, nNodes = i+1, 0
+    if first < len(sizes):
+        yield range(first, len(sizes))
+
+# Each topology once, in order of first use, and the index of each frame's
+def topologyTable(frames):
+    indexes, topologies = {}, []
+    frameTopology = np.empty(len(frames), dtype=np.int32)
+    for i, frame in enumerate(frames):
+        key = id(frame.topology)
+        if key not in indexes:
+            indexes[key] = len(topologies)
+            topologies.append(frame.topology)
+        frameTopology[i] = indexes[key]
+    return topologies, frameTopology
+
+# Write a .npy member to an open zip file, in chunks. Chunks are arrays of
+# dtype whose lengths add up to length
+def writeColumn(archive, name, dtype, length, chunks):
+    dtype = np.dtype(dtype)
+    with archive.open(name + '.npy', 'w', force_zip64=True) as f:
+        header = {'descr': np.lib.format.dtype_to_descr(dtype),
+                  'fortran_order': False, 'shape': (length,)}
+        np.lib.format.write_array_header_1_0(f, header)
+        for chunk in chunks:
+            f.write(np.ascontiguousarray(chunk, dtype=dtype).tobytes())
+
+def saveNpz(stickmanFrames, path):
+    frames = stickmanFrames.frames
+    names = list(stickmanFrames.figures)
+    codes = {name: i for i, name in enumerate(names)}
+    topologies, frameTopology = topologyTable(frames)
+
+    nodeOffsets = np.zeros(len(frames) + 1, dtype=np.int64)
+    nodeOffsets[1:] = np.cumsum([len(frame) for frame in frames])
+    edgeOffsets = np.zeros(len(topologies) + 1, dtype=np.int64)
+    edgeOffsets[1:] = np.cumsum([len(topology) for topology in topologies])
+    nNodes, nEdges = int(nodeOffsets[-1]), int(edgeOffsets[-1])
+
+    # Columns are generated chunk by chunk while they are written
+    def nodeColumn(read):
+        for chunk in frameChunks([len(frame) for frame in frames]):
+            yield [read(node) for i in chunk for node in frames[i].nodes]
+
+    def edgeColumn(read):
+        for topology in topologies:
+            yield [read(edge) for edge in topology.edges]
+
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as archive:
+        small = {'nodeOffsets': nodeOffsets, 'frameTopology': frameTopology,
+                 'edgeOffsets': edgeOffsets, 'figureNames': np.array(names, dtype=str),
+                 'figureVisible': [stickmanFrames.figures[n].visible for n in names],
+                 'figureLocked': [stickmanFrames.figures[n].locked for n in names],
+                 'resolution': [stickmanFrames.imgWidth, stickmanFrames.imgHeight]}
+        for name, array in small.items():
+            array = np.asarray(array)
+            writeColumn(archive, name, array.dtype, len(array), [array])
+
+        writeColumn(archive, 'x', np.float64, nNodes, nodeColumn(lambda node: node.x))
+        writeColumn(archive, 'y', np.float64, nNodes, nodeColumn(lambda node: node.y))
+        writeColumn(archive, 'figure', np.int32, nNodes,
+                    nodeColumn(lambda node: codes.get(node.figure, 0)))
+        writeColumn(archive, 'edgeNode1', np.int32, nEdges, edgeColumn(lambda edge: edge[0]))
+        writeColumn(archive, 'edgeNode2', np.int32, nEdges, edgeColumn(lambda edge: edge[1]))
+        writeColumn(archive, 'edgeCircle', np.bool_, nEdges,
+                    edgeColumn(lambda edge: edge[2] == 'circle'))
+
+# Animation with these figures (names, visible, locked) and resolution
+def emptyAnimation(names, visible, locked, resolution):
+    stickmanFrames = StickmanFrames(*resolution)
+    stickmanFrames.figures = {}
+    for name, isVisible, isLocked in zip(names, visible, locked):
+        figure = Figure(name)
+        figure.visible, figure.locked = bool(isVisible), bool(isLocked)
+        stickmanFrames.figures[name] = figure
+    if len(stickmanFrames.figures) == 0:
+        stickmanFrames.figures = {DEFAULT_FIGURE: Figure(DEFAULT_FIGURE)}
+    stickmanFrames.activeFigure = next(iter(stickmanFrames.figures))
+    return stickmanFrames
+
+# A frame from node rows (x, y, figure name) and its topology
+def makeFrame(xs, ys, figures, topology):
+    frame = Frame(topology)
+    frame.nodes = [Node(x, y, figure) for x, y, figure in zip(xs, ys, figures)]
+    return frame
+
+def loadNpz(path):
+    with np.load(path) as data:
+        names = data['figureNames'].tolist()
+        stickmanFrames = emptyAnimation(names, data['figureVisible'],
+                                        data['figureLocked'], data['resolution'].tolist())
+
+        # Each topology is built (and interned) once
+        edgeOffsets = data['edgeOffsets']
+        node1, node2 = data['edgeNode1'].tolist(), data['edgeNode2'].tolist()
+        types = np.where(data['edgeCircle'], 'circle', 'line').tolist()
+        topologies = [Topology.get(zip(node1[a:b], node2[a:b], types[a:b]))
+                      for a, b in zip(edgeOffsets[:-1], edgeOffsets[1:])]
+
+        nodeOffsets = data['nodeOffsets']
+        frameTopology = data['frameTopology'].tolist()
+        x, y, figure = data['x'], data['y'], data['figure']
+        names = np.array(names, dtype=object)
+        frames = stickmanFrames.frames
+        # Nodes are converted to Python values a chunk at a time
+        for chunk in frameChunks(np.diff(nodeOffsets)):
+            first, last = nodeOffsets[chunk.start], nodeOffsets[chunk.stop]
+            xs = x[first:last].tolist()
+            ys = y[first:last].tolist()
+            figures = names[figure[first:last]].tolist()
+            for i in chunk:
+                a, b = nodeOffsets[i] - first, nodeOffsets[i+1] - first
+                frames.append(makeFrame(xs[a:b], ys[a:b], figures[a:b],
+                                        topologies[frameTopology[i]]))
+    return stickmanFrames
+
+# Paths of the node and edge tables for a .csv path
+def csvPaths(path):
+    base = os.path.splitext(path)[0]
+    return base + '_nodes.csv', base + '_edges.csv'
+
+# Tables are written a chunk of frames at a time. Edge rows are repeated for
+# each frame, so every row stands on its own
+def saveCsv(stickmanFrames, path):
+    nodesPath, edgesPath = csvPaths(path)
+    frames = stickmanFrames.frames
+    with open(nodesPath, 'w', newline='') as nodesFile,\
+         open(edgesPath, 'w', newline='') as edgesFile:
+        nodes, edges = csv.writer(nodesFile), csv.writer(edgesFile)
+        nodes.writerow(('frame', 'node', 'x', 'y', 'figure'))
+        edges.writerow(('frame', 'edge', 'node1', 'node2', 'type'))
+        for chunk in frameChunks([len(frame) for frame in frames]):
+            nodes.writerows((i, j, repr(node.x), repr(node.y), node.figure)
+                            for i in chunk for j, node in enumerate(frames[i].nodes))
+            edges.writerows((i, j) + edge
+                            for i in chunk for j, edge in enumerate(frames[i].edges))
+
+# Rows are read in order, so one frame is built at a time. Figures and
+# resolution are not in the tables: the defaults are used, and figures are
+# created as they appear. Empty frames at the end have no rows, so they are
+# not loaded
+def loadCsv(path):
+    nodesPath, edgesPath = csvPaths(path)
+    stickmanFrames = StickmanFrames()
+    frames = stickmanFrames.frames
+
+    with open(nodesPath, newline='') as f:
+        rows = csv.reader(f)
+        next(rows, None)
+        for frameIndex, nodeIndex, x, y, figure in rows:
+            frameIndex = int(frameIndex)
+            while len(frames) <= frameIndex:
+                frames.append(Frame())
+            frames[frameIndex].nodes.append(Node(float(x), float(y), figure))
+            if figure not in stickmanFrames.figures:
+                stickmanFrames.figures[figure] = Figure(figure)
+
+    # Edges of a frame are collected until the next frame starts
+    def setEdges(frameIndex, edges):
+        while len(frames) <= frameIndex:
+            frames.append(Frame())
+        frames[frameIndex].topology = Topology.get(edges)
+
+    with open(edgesPath, newline='') as f:
+        rows = csv.reader(f)
+        next(rows, None)
+        current, edges = None, []
+        for frameIndex, edgeIndex, node1, node2, edgeType in rows:
+            frameIndex = int(frameIndex)
+            if frameIndex != current:
+                if current is not None:
+                    setEdges(current, edges)
+                current, edges = frameIndex, []
+            edges.append((int(node1), int(node2), edgeType))
+        if current is not None:
+            setEdges(current, edges)
+    return stickmanFrames
+
+# The header holds the figures and resolution. Then each line is a frame:
+# {"frame": i, "nodes": [[x, y, figure], ...], "edges": [[node1, node2, type], ...]}
+def saveJsonLines(stickmanFrames, path):
+    figures = stickmanFrames.figures
+    header = {'resolution': [stickmanFrames.imgWidth, stickmanFrames.imgHeight],
+              'figures': [[name, figure.visible, figure.locked]
+                          for name, figure in figures.items()]}
+    with open(path, 'w') as f:
+        f.write(json.dumps(header) + '\n')
+        for i, frame in enumerate(stickmanFrames.frames):
+            f.write(json.dumps({'frame': i,
+                'nodes': [[node.x, node.y, node.figure] for node in frame.nodes],
+                'edges': frame.edges}) + '\n')
+
+def loadJsonLines(path):
+    with open(path) as f:
+        header = json.loads(f.readline())
+        names, visible, locked = zip(*header['figures']) if header['figures'] else ((), (), ())
+        stickmanFrames = emptyAnimation(names, visible, locked, header['resolution'])
+        frames = stickmanFrames.frames
+        for line in f:
+            if line.strip() == '':
+                continue
+            data = json.loads(line)
+            while len(frames) <= data['frame']:
+                frames.append(Frame())
+            xs, ys, figures = zip(*data['nodes']) if data['nodes'] else ((), (), ())
+            frames[data['frame']] = makeFrame(xs, ys, figures, Topology.get(data['edges']))
+    return stickmanFrames
+
+# Time saving and loading a big animation in each format
+if __name__ == '__main__':
+    import time
+    import tempfile
+
+    # 2000 frames of 5 figures with 20 nodes each
+    random = np.random.default_rng(0)
+    st = StickmanFrames(1280, 720)
+    st.addFigure('Figure 2')
+    edges = [(i, i+1, 'circle' if i % 20 == 0 else 'line') for i in range(99) if i % 20 != 19]
+    for frameIndex in range(2000):
+        frame = Frame()
+        st.frames.append(frame)
+        for i, (x, y) in enumerate(random.uniform(0, 1000, (100, 2))):
+            frame.insertNode(x, y, 'Figure 2' if i < 20 else 'Figure 1')
+        frame.setTopology(Topology.get(edges))
+
+    folder = tempfile.mkdtemp()
+    for extension in EXTENSIONS:
+        path = os.path.join(folder, 'poses' + extension)
+        start = time.perf_counter()
+        save(st, path)
+        saved = time.perf_counter()
+        loaded = load(path)
+        end = time.perf_counter()
+        same = all(np.array_equal(a.positions(), b.positions()) and a.topology is b.topology
+                   for a, b in zip(st.frames, loaded.frames))
+        print('%6s: save %6.0f ms, load %6.0f ms, same animation: %s' %
+              (extension, (saved - start) * 1000, (end - saved) * 1000, same))
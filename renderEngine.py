@@ -0,0 +1,181 @@
+import cv2
+import time
+import numpy as np
+
+from viewTransform import ViewTransform
+
+# Points are given to OpenCV with this many fractional bits, so nodes keep
+# their sub-pixel position at any zoom (see the shift argument of cv2 calls)
+SHIFT = 4
+ONE = 1 << SHIFT
+
+# Draws stickman frames (see stickmanFrames.Frame) into numpy images. All
+# line edges of a color and thickness go in a single cv2.polylines call, and
+# so do all nodes of a color (a zero length line with round caps is a filled
+# circle). Circle centers and radii are computed for all edges at once.
+#   antialias: smooth edges with cv2.LINE_AA
+#   supersample: draw this many times bigger and shrink, for the best
+#                quality on exported images. 1 is off
+class RenderEngine:
+    def __init__(self, antialias = False, supersample = 1):
+        self.antialias = antialias
+        self.supersample = max(int(supersample), 1)
+
+    # Memory used to draw one image of this size: the image itself and, when
+    # supersampling, the big layer and coverage and their shrunk copies
+    def nBytes(self, width, height, channels = 4):
+        pixels = width * height
+        if self.supersample == 1:
+            return pixels * channels
+        big = self.supersample ** 2 * pixels * (channels + 1)
+        # Shrunk layer (bytes), coverage (float32) and blended region (float64)
+        return pixels * channels + big + pixels * (channels + 4 + 8 * channels)
+    
+    def lineType(self):
+        return cv2.LINE_AA if self.antialias else cv2.LINE_8
+
+    # Draw frame on image through transform (identity if None). Figures in
+    # hidden and those outside the image are skipped
+    def draw(self, image, frame, lineThickness = 10, lineColor = (0, 255, 0),
+             nodeColor = (0, 255, 0), selectedColor = (255, 0, 0),
+             drawNodes = True, transform = None, hidden = ()):
+        if transform is None:
+            transform = ViewTransform()
+        if len(frame) == 0:
+            return
+
+        colors = (lineColor, nodeColor, selectedColor)
+        if self.supersample > 1:
+            self.drawSupersampled(image, frame, lineThickness, colors, drawNodes,
+                                  transform, hidden)
+        else:
+            self.rasterize(image, frame, lineThickness, colors, drawNodes,
+                           transform, hidden)
+
+    def rasterize(self, image, frame, lineThickness, colors, drawNodes,
+                  transform, hidden):
+        lineColor, nodeColor, selectedColor = colors
+        lineType = self.lineType()
+
+        area = transform.visibleArea(image.shape[1], image.shape[0])
+        margin = transform.lengthToSource(lineThickness)
+        nodeMask, edgeMask = frame.visibleMasks(area, margin, hidden)
+
+        # Every node is mapped to the image at once, in fixed point
+        points = transform.toScreen(frame.positions()) * ONE
+        ids, circles = frame.topology.indexArrays()
+
+        # Lines, each one a polyline of two points
+        lines = ids[edgeMask & ~circles]
+        if len(lines) > 0:
+            segments = np.rint(points[lines]).astype(np.int32)
+            cv2.polylines(image, segments, False, lineColor, lineThickness,
+                          lineType, SHIFT)
+
+        # Circle edges are filled circles through both nodes
+        pairs = points[ids[edgeMask & circles]]
+        if len(pairs) > 0:
+            centers = np.rint(pairs.mean(axis=1)).astype(int).tolist()
+            radii = np.rint(np.linalg.norm(pairs[:, 0] - pairs[:, 1], axis=1) / 2)
+            for center, radius in zip(centers, radii.astype(int).tolist()):
+                cv2.circle(image, tuple(center), radius, lineColor, -1, lineType, SHIFT)
+
+        if not drawNodes:
+            return
+
+        # Nodes, one call for each color. A line of thickness 2r covers the
+        # same pixels as a circle of radius r
+        selected = np.array([node.isSelected for node in frame.nodes], dtype=bool)
+        for color, mask in ((nodeColor, nodeMask & ~selected),
+                            (selectedColor, nodeMask & selected)):
+            if not mask.any():
+                continue
+            dots = np.rint(points[mask]).astype(np.int32)
+            dots = np.repeat(dots[:, None, :], 2, axis=1)
+            cv2.polylines(image, dots, False, color, 2 * lineThickness,
+                          lineType, SHIFT)
+
+    # Draw supersample times bigger on an empty layer, shrink it with area
+    # interpolation and lay it over the image. The layer and its coverage
+    # are shrunk the same way, so colors blend over the image by coverage
+    def drawSupersampled(self, image, frame, lineThickness, colors, drawNodes,
+                         transform, hidden):
+        factor = self.supersample
+        height, width = image.shape[:2]
+        channels = image.shape[2] if image.ndim == 3 else 1
+        transform = transform.scaled(factor)
+
+        layer = np.zeros((height * factor, width * factor, channels), dtype=np.uint8)
+        self.rasterize(layer, frame, lineThickness * factor, colors, drawNodes,
+                       transform, hidden)
+        # Coverage is the same drawing in a single channel, always 255
+        coverage = np.zeros((height * factor, width * factor), dtype=np.uint8)
+        self.rasterize(coverage, frame, lineThickness * factor, (255, 255, 255),
+                       drawNodes, transform, hidden)
+
+        layer = cv2.resize(layer, (width, height), interpolation=cv2.INTER_AREA)
+        layer = layer.reshape(height, width, channels)
+        coverage = cv2.resize(coverage, (width, height), interpolation=cv2.INTER_AREA)
+        coverage = coverage.reshape(height, width, 1).astype(np.float32) / 255
+
+        # Only the region with something drawn is blended
+        rows = np.flatnonzero(coverage.any(axis=(1, 2)))
+        cols = np.flatnonzero(coverage.any(axis=(0, 2)))
+        if len(rows) == 0:
+            return
+        y1, y2, x1, x2 = rows[0], rows[-1]+1, cols[0], cols[-1]+1
+
+        shape = image[y1:y2, x1:x2].shape
+        region = image[y1:y2, x1:x2].reshape(y2-y1, x2-x1, channels)
+        # Layer colors are already multiplied by their coverage
+        blended = region * (1 - coverage[y1:y2, x1:x2]) + layer[y1:y2, x1:x2]
+        image[y1:y2, x1:x2] = np.rint(blended).astype(np.uint8).reshape(shape)
+
+# Time to draw frames with a growing number of edges, with one OpenCV call
+# per edge (as drawFigure used to) and with each engine mode
+if __name__ == '__main__':
+    from stickmanFrames import Frame, Topology
+
+    def perEdge(image, frame, lineThickness, color):
+        for id1, id2, edgeType in frame.edges:
+            node1, node2 = frame.nodes[id1], frame.nodes[id2]
+            if edgeType == 'line':
+                cv2.line(image, (int(node1.x), int(node1.y)),
+                         (int(node2.x), int(node2.y)), color, lineThickness)
+            else:
+                center = (int(node1.x + node2.x) // 2, int(node1.y + node2.y) // 2)
+                radius = int(node1.distanceTo(node2) / 2)
+                cv2.circle(image, center, radius, color, -1)
+        for node in frame.nodes:
+            cv2.circle(image, (int(node.x), int(node.y)), lineThickness, color, -1)
+
+    def timeIt(draw, repeats = 20):
+        start = time.perf_counter()
+        for i in range(repeats):
+            draw()
+        return (time.perf_counter() - start) / repeats * 1000
+
+    engines = (('plain', RenderEngine()),
+               ('antialias', RenderEngine(antialias=True)),
+               ('supersample x2', RenderEngine(supersample=2)))
+
+    print('%8s %10s' % ('edges', 'per edge') +
+          ''.join('%16s' % name for name, engine in engines) + '   (ms)')
+    random = np.random.default_rng(0)
+    image = np.zeros((720, 1280, 3), dtype=np.uint8)
+    for nEdges in (10, 100, 1000, 10000):
+        # A chain of short edges wandering over the image, like many small
+        # figures. One edge every ten is a circle (a head)
+        steps = random.normal(0, 15, (nEdges + 1, 2))
+        steps[0] = (640, 360)
+        frame = Frame()
+        for x, y in np.cumsum(steps, axis=0) % (1280, 720):
+            frame.insertNode(x, y)
+        frame.setTopology(Topology.get((i, i+1, 'circle' if i % 10 == 0 else 'line')
+                                       for i in range(nEdges)))
+
+        times = [timeIt(lambda: perEdge(image, frame, 3, (0, 255, 0)))]
+        for name, engine in engines:
+            times.append(timeIt(lambda: engine.draw(image, frame, 3)))
+        print('%8d %10.2f' % (nEdges, times[0]) +
+              ''.join('%16.2f' % t for t in times[1:]))
@@ -0,0 +1,119 @@
+import time
+
+# Everything that changed since the last render. Input handlers only write
+# here, the render callback reads it once and applies all changes together
+class PendingChanges:
+    def __init__(self):
+        # Accumulated zoom and translation (in screen pixels)
+        self.zoom = 0
+        self.translation = [0, 0]
+        # Frame requested by the user. frameChanged is also True when the
+        # video frame must be processed again for the same index
+        self.frameIndex = None
+        self.frameChanged = False
+        # The stickman drawing changed
+        self.drawChanged = False
+        # Input is continuous, a cheap preview is enough (see markInteraction)
+        self.preview = False
+
+    # True if zoom or translation were requested
+    def viewChanged(self):
+        return self.zoom != 0 or self.translation != [0, 0]
+
+# The scheduler coalesces input events in a single render. Renders are placed
+# on the tk event loop with after_idle and never run more often than targetFps.
+# While input is continuous renders are previews, and a full quality render
+# follows once input has been idle for idleDelay milliseconds
+class RenderScheduler:
+    def __init__(self, root, renderCallback, targetFps = 60, idleDelay = 150):
+        self.root = root
+        self.renderCallback = renderCallback
+        self.targetFps = targetFps
+        self.idleDelay = idleDelay
+
+        self.pending = PendingChanges()
+        self.scheduled = None
+        self.lastRender = 0
+
+        # Time of the last interactive request and the full quality render
+        # waiting for input to stop
+        self.lastInteraction = 0
+        self.refineTimer = None
+
+    # Zoom-in (amount > 0) or zoom-out (amount < 0) on next render
+    def requestZoom(self, amount):
+        self.pending.zoom += amount
+        self.schedule()
+
+    # Move the video by x, y pixels on next render
+    def requestTranslation(self, x = 0, y = 0):
+        self.pending.translation[0] += x
+        self.pending.translation[1] += y
+        self.schedule()
+
+    # Go to a frame on next render. If frameIndex is None, the current frame
+    # is processed again
+    def requestFrame(self, frameIndex = None):
+        if frameIndex is not None:
+            self.pending.frameIndex = frameIndex
+        self.pending.frameChanged = True
+        self.schedule()
+
+    # Only the drawing has to be updated
+    def requestDraw(self):
+        self.pending.drawChanged = True
+        self.schedule()
+
+    # Input handlers of things users repeat quickly (held keys, mouse wheel,
+    # frame steps) call this. An input that comes soon after the previous one
+    # is continuous, and is rendered as a preview
+    def markInteraction(self):
+        now = time.perf_counter()
+        if now - self.lastInteraction < self.idleDelay / 1000:
+            self.pending.preview = True
+        self.lastInteraction = now
+
+    # After a preview, render the current frame again in full quality once
+    # input stops
+    def scheduleRefine(self):
+        if self.refineTimer is not None:
+            self.root.after_cancel(self.refineTimer)
+        self.refineTimer = self.root.after(self.idleDelay, self.refine)
+
+    def refine(self):
+        self.refineTimer = None
+        # Input came while waiting, wait for it to stop
+        idle = (time.perf_counter() - self.lastInteraction) * 1000
+        if idle < self.idleDelay:
+            self.refineTimer = self.root.after(int(self.idleDelay - idle) + 1, self.refine)
+            return
+        self.requestFrame()
+
+    # Place a render on the event loop, if there isn't one already
+    def schedule(self):
+        if self.scheduled is not None:
+            return
+
+        # Wait until the frame interval has passed since the last render
+        delay = self.lastRender + 1 / self.targetFps - time.perf_counter()
+        if delay > 0:
+            self.scheduled = self.root.after(int(delay * 1000) + 1, self.run)
+        else:
+            self.scheduled = self.root.after_idle(self.run)
+
+    # Render now whatever is pending
+    def flush(self):
+        if self.scheduled is not None:
+            self.root.after_cancel(self.scheduled)
+        self.run()
+
+    # Hand all pending changes to the render callback in one call
+    def run(self):
+        self.scheduled = None
+        self.lastRender = time.perf_counter()
+
+        pending = self.pending
+        self.pending = PendingChanges()
+        self.renderCallback(pending)
+        if pending.preview:
+            self.scheduleRefine()
@@ -0,0 +1,145 @@
+import os
+import json
+import copy
+
+# Settings are kept for each user in their home folder
+SETTINGS_PATH = os.path.join(os.path.expanduser('~'), '.stickmanAnimator.json')
+
+# Drawing and editing settings, the same on any machine
+GENERAL_DEFAULTS = {
+    'nodeColor': (0, 255, 0),
+    'lineColor': (0, 255, 0),
+    'selectedColor': (255, 0, 0),
+    'exportColor': (0, 0, 0),
+    'lineThickness': 10,
+    'frameJump': 1,
+    'onionFrames': 0,
+    'onionOpacity': 40,
+}
+
+# Performance settings depend on the hardware, so there are named profiles
+# of them. Each one is:
+#   decodeCacheSize: decoded video frames kept (see VideoProcessing.decode)
+#   prefetchDepth: frames decoded ahead while the app is idle
+#   exportWorkers: images drawn and written at the same time on export
+#   previewDownscale: previews compute one pixel every this many
+#   pngCompression: 0 (fast, big files) to 9 (slow, small files)
+#   memoryBudget: MB all caches may use (see MemoryManager)
+#   exportAntialias: 1 to smooth the edges of exported images
+#   exportSupersample: exported images are drawn this many times bigger and
+#                      shrunk (see RenderEngine). 1 is off
+PERFORMANCE_DEFAULTS = {
+    'decodeCacheSize': 8,
+    'prefetchDepth': 4,
+    'exportWorkers': 2,
+    'previewDownscale': 2,
+    'pngCompression': 3,
+    'memoryBudget': 1024,
+    'exportAntialias': 0,
+    'exportSupersample': 1,
+}
+
+# Smallest and biggest value of each integer setting. Colors are (R, G, B)
+# with each channel from 0 to 255
+LIMITS = {
+    'lineThickness': (1, 200),
+    'frameJump': (1, 24),
+    'onionFrames': (0, 10),
+    'onionOpacity': (0, 100),
+    'decodeCacheSize': (1, 1000),
+    'prefetchDepth': (0, 64),
+    'exportWorkers': (1, 64),
+    'previewDownscale': (1, 16),
+    'pngCompression': (0, 9),
+    'memoryBudget': (1, 2**20),
+    'exportAntialias': (0, 1),
+    'exportSupersample': (1, 4),
+}
+
+# A setting as read from a file, converted to its type and clamped to its
+# limits. Returns default if it can't be converted
+def checkedValue(key, value, default):
+    try:
+        if isinstance(default, tuple):
+            value = tuple(min(max(int(c), 0), 255) for c in value)
+            return value if len(value) == len(default) else default
+        low, high = LIMITS[key]
+        return min(max(int(value), low), high)
+    except (TypeError, ValueError):
+        return default
+
+# A dict inside the data read from a file, empty if missing or broken
+def section(data, key):
+    value = data.get(key)
+    return value if isinstance(value, dict) else {}
+
+DEFAULT_PROFILE = 'default'
+PROFILES = {
+    DEFAULT_PROFILE: PERFORMANCE_DEFAULTS,
+    'laptop': dict(PERFORMANCE_DEFAULTS, decodeCacheSize=4, prefetchDepth=2,
+                   exportWorkers=2, previewDownscale=4, pngCompression=1,
+                   memoryBudget=512, exportAntialias=1),
+    'workstation': dict(PERFORMANCE_DEFAULTS, decodeCacheSize=32, prefetchDepth=8,
+                        exportWorkers=8, previewDownscale=1, pngCompression=6,
+                        memoryBudget=4096, exportAntialias=1, exportSupersample=2),
+}
+
+# Settings of the app, read from and saved to a JSON file. Missing or broken
+# values fall back to the defaults and values out of range are clamped, so
+# older or hand edited files always load
+class Settings:
+    def __init__(self, path = SETTINGS_PATH):
+        self.path = path
+        self.general = dict(GENERAL_DEFAULTS)
+        self.profiles = copy.deepcopy(PROFILES)
+        self.profile = DEFAULT_PROFILE
+
+    # Read the file, if there is one. Returns False if it could not be read
+    def load(self):
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return False
+
+        if not isinstance(data, dict):
+            return False
+        for key, value in section(data, 'general').items():
+            if key in GENERAL_DEFAULTS:
+                self.general[key] = checkedValue(key, value, GENERAL_DEFAULTS[key])
+        for name, values in section(data, 'profiles').items():
+            profile = dict(PERFORMANCE_DEFAULTS)
+            if isinstance(values, dict):
+                profile.update((key, checkedValue(key, value, PERFORMANCE_DEFAULTS[key]))
+                               for key, value in values.items()
+                               if key in PERFORMANCE_DEFAULTS)
+            self.profiles[name] = profile
+        if isinstance(data.get('profile'), str) and data['profile'] in self.profiles:
+            self.profile = data['profile']
+        return True
+
+    # Write the file. It is written aside and then moved, so a failure never
+    # leaves half a file. Returns False if it could not be written
+    def save(self):
+        data = {'general': self.general, 'profile': self.profile,
+                'profiles': self.profiles}
+        temporary = self.path + '.tmp'
+        try:
+            with open(temporary, 'w') as f:
+                json.dump(data, f, indent=2)
+            os.replace(temporary, self.path)
+        except OSError:
+            return False
+        return True
+
+    # Performance settings of the active profile
+    def performance(self):
+        return dict(self.profiles[self.profile])
+
+    # Make a profile active, keeping its values (or creating it with these)
+    def useProfile(self, name, values = None):
+        if values is not None:
+            self.profiles[name] = dict(PERFORMANCE_DEFAULTS, **values)
+        elif name not in self.profiles:
+            self.profiles[name] = dict(PERFORMANCE_DEFAULTS)
+        self.profile = name
@@ -1,63 +1,368 @@
 import cv2
 import copy
+import weakref
+import contextlib
+import collections
 import numpy as np
+import concurrent.futures
 
-# Node is a 2D-position in the screen
+from viewTransform import ViewTransform
+from renderEngine import RenderEngine
+
+# Ways to fill frames between keyframes (see StickmanFrames.interpolate)
+LINEAR, EASE, CATMULL_ROM = 'linear', 'ease', 'catmull-rom'
+INTERPOLATION_MODES = (LINEAR, EASE, CATMULL_ROM)
+
+# Line thickness is given for a view where the whole video is this wide. It
+# grows with zoom and with the size of exported images
+REFERENCE_WIDTH = 800
+
+# Name of the figure nodes belong to when none was created
+DEFAULT_FIGURE = 'Figure 1'
+
+# Drawing quality when none is given (see StickmanFrames.drawFigure)
+DEFAULT_ENGINE = RenderEngine()
+
+# Rough memory used by one node and one edge. Used to estimate the size of
+# undo history entries
+NODE_BYTES = 200
+EDGE_BYTES = 150
+
+# Node is a 2D-position in source video coordinates
 class Node:
+    # Nodes from projects saved before figures existed belong to the default
+    figure = DEFAULT_FIGURE
+    
     # Constructor
-    def __init__(self, x = 0, y = 0):
+    def __init__(self, x = 0, y = 0, figure = DEFAULT_FIGURE):
         self.setPos(x, y)
         self.isSelected = False
+        self.figure = figure
     
-    # Reset position of the node
+    # Reset position of the node. Positions are not rounded, so they keep
+    # their precision at any zoom or export resolution
     def setPos(self, x, y):
-        self.x, self.y = int(x), int(y)
+        self.x, self.y = float(x), float(y)
     
     # Euclidian Distance to other node
     def distanceTo(self, other):
         squared = (self.x - other.x) ** 2 + (self.y - other.y) ** 2
         return np.sqrt(squared)
 
-# Frame is a collection of nodes connected by edges
+# A figure is a named group of nodes, usually one character. Nodes know the
+# name of their figure. Here we keep how the figure is shown and edited
+class Figure:
+    def __init__(self, name):
+        self.name = name
+        # Hidden figures are not drawn nor exported
+        self.visible = True
+        # Locked figures are drawn but their nodes can not be selected
+        self.locked = False
+
+# Topology is the edge table of a frame, a tuple of (index1, index2, edgeType)
+# tuples. It never changes, so frames with the same connectivity share one
+# object and a frame that adds or removes an edge gets a new one (copy on
+# write). Topologies are interned: equal edge tables are the same object
+class Topology:
+    __slots__ = ('edges', 'arrays', '__weakref__')
+    
+    # All topologies alive, by edge table
+    shared = weakref.WeakValueDictionary()
+    
+    # Use Topology.get instead, so the table is interned
+    def __init__(self, edges):
+        self.edges = edges
+        self.arrays = None
+    
+    def __len__(self):
+        return len(self.edges)
+    
+    # Saved projects keep one copy of each topology and intern it on load
+    def __reduce__(self):
+        return (Topology.get, (self.edges,))
+    
+    # Return the shared topology for an edge table (any iterable of edges)
+    @staticmethod
+    def get(edges = ()):
+        edges = tuple(tuple(edge) for edge in edges)
+        topology = Topology.shared.get(edges)
+        if topology is None:
+            topology = Topology(edges)
+            Topology.shared[edges] = topology
+        return topology
+    
+    # Node indexes of all edges, shape (n, 2), and a mask of the circle
+    # edges. Built once, as the table never changes
+    def indexArrays(self):
+        if self.arrays is None:
+            ids = np.array([edge[:2] for edge in self.edges], dtype=np.intp)
+            circles = np.array([edge[2] == 'circle' for edge in self.edges], dtype=bool)
+            self.arrays = (ids.reshape(-1, 2), circles)
+        return self.arrays
+    
+    # Topology with one more edge at the end
+    def withEdge(self, index1, index2, edgeType = 'line'):
+        return Topology.get(self.edges + ((index1, index2, edgeType),))
+    
+    # Topology without one edge
+    def withoutEdge(self, edgeIndex):
+        return Topology.get(self.edges[:edgeIndex] + self.edges[edgeIndex+1:])
+    
+    # Topology with the type of one edge changed
+    def withEdgeType(self, edgeIndex, edgeType):
+        id1, id2, oldType = self.edges[edgeIndex]
+        return Topology.get(self.edges[:edgeIndex] + ((id1, id2, edgeType),) +
+                            self.edges[edgeIndex+1:])
+    
+    # Topology without the edges of a node. Bigger indexes are reduced by one
+    def withoutNode(self, nodeIndex):
+        edges = []
+        for id1, id2, edgeType in self.edges:
+            if id1 == nodeIndex or id2 == nodeIndex:
+                continue
+            edges.append((id1 - (id1 > nodeIndex), id2 - (id2 > nodeIndex), edgeType))
+        return Topology.get(edges)
+    
+    # Topology with node indexes changed by a remap table: node i becomes
+    # remap[i], and edges of nodes mapped to -1 are dropped. One pass only
+    def remapped(self, remap):
+        edges = []
+        for id1, id2, edgeType in self.edges:
+            new1, new2 = remap[id1], remap[id2]
+            if new1 >= 0 and new2 >= 0:
+                edges.append((int(new1), int(new2), edgeType))
+        return Topology.get(edges)
+    
+    # Topology with only the edges between the first nNodes nodes. If every
+    # edge is kept, this same object is returned
+    def restrictedTo(self, nNodes):
+        edges = [edge for edge in self.edges if edge[0] < nNodes and edge[1] < nNodes]
+        if len(edges) == len(self.edges):
+            return self
+        return Topology.get(edges)
+
+# Frame is a collection of nodes connected by edges. Edges are kept in a
+# shared Topology
 class Frame:
-    def __init__(self):
+    # Version grows each time nodes or edges change, so caches built from
+    # this frame know when they are outdated. Defined on the class so frames
+    # from older saved projects also have it
+    version = 0
+    # Node indexes and bounding box of each figure, for the version they were
+    # computed (see figureBoxes)
+    figureCache = None
+    # Positions of all nodes, for the version they were read (see positions)
+    positionsCache = None
+    # Index of the selected edge, or None. Edges live in the shared topology,
+    # so their selection is kept here. Changing the edges unselects it
+    selectedEdge = None
+    
+    def __init__(self, topology = None):
         self.nodes = []
-        self.edges = []
+        self.topology = topology if topology is not None else Topology.get()
     
     def __len__(self):
         return len(self.nodes)
     
+    # Caches are not saved
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop('figureCache', None)
+        state.pop('positionsCache', None)
+        return state
+    
+    # Projects saved before topologies existed have an edge list
+    def __setstate__(self, state):
+        if 'edges' in state:
+            state['topology'] = Topology.get(state.pop('edges'))
+        self.__dict__.update(state)
+    
+    # For each figure on this frame, the indexes of its nodes and its bounding
+    # box (x1, y1, x2, y2). Computed again only when the frame changes
+    def figureBoxes(self):
+        if self.figureCache is not None and self.figureCache[0] == self.version:
+            return self.figureCache[1]
+        
+        groups = {}
+        for i, node in enumerate(self.nodes):
+            groups.setdefault(node.figure, []).append(i)
+        
+        # Circle edges are discs that can reach past their nodes. They go
+        # with the figure of their first node, as in visibleMasks
+        positions = self.positions()
+        ids, circles = self.topology.indexArrays()
+        circleIds = ids[circles]
+        pairs = positions[circleIds]
+        centers = pairs.mean(axis=1)
+        radii = np.linalg.norm(pairs[:, 0] - pairs[:, 1], axis=1)[:, None] / 2
+        
+        boxes = {}
+        for name, indexes in groups.items():
+            indexes = np.array(indexes)
+            points = positions[indexes]
+            low, high = points.min(axis=0), points.max(axis=0)
+            discs = np.isin(circleIds[:, 0], indexes)
+            if discs.any():
+                low = np.minimum(low, (centers[discs] - radii[discs]).min(axis=0))
+                high = np.maximum(high, (centers[discs] + radii[discs]).max(axis=0))
+            boxes[name] = (indexes, (low[0], low[1], high[0], high[1]))
+        
+        self.figureCache = (self.version, boxes)
+        return boxes
+    
+    # Figures whose box, grown by margin, touches the area (x1, y1, x2, y2).
+    # Figures in skip are left out
+    def figuresInArea(self, area, margin = 0, skip = ()):
+        figures = []
+        for name, (indexes, box) in self.figureBoxes().items():
+            if name in skip:
+                continue
+            if box[0] - margin > area[2] or box[2] + margin < area[0] or\
+               box[1] - margin > area[3] or box[3] + margin < area[1]:
+                continue
+            figures.append((name, indexes))
+        return figures
+    
+    # Masks of the nodes and edges to draw: those of figures not hidden and
+    # inside area (everything if area is None). Edges go with their first node
+    def visibleMasks(self, area = None, margin = 0, hidden = ()):
+        nodeMask = np.zeros(len(self.nodes), dtype=bool)
+        if area is None:
+            area = (-np.inf, -np.inf, np.inf, np.inf)
+        for name, indexes in self.figuresInArea(area, margin, hidden):
+            nodeMask[indexes] = True
+        
+        edgeMask = nodeMask[self.topology.indexArrays()[0][:, 0]]
+        return nodeMask, edgeMask
+    
+    # Edges of this frame, a tuple of (index1, index2, edgeType)
+    @property
+    def edges(self):
+        return self.topology.edges
+    
+    # Mark frame as modified
+    def touch(self):
+        self.version += 1
+    
+    # Replace the edge table
+    def setTopology(self, topology):
+        self.topology = topology
+        self.selectedEdge = None
+        self.touch()
+    
     # Just append one node at the end
-    def insertNode(self, x, y):
-        self.nodes.append(Node(x, y))
+    def insertNode(self, x, y, figure = DEFAULT_FIGURE):
+        self.nodes.append(Node(x, y, figure))
+        self.touch()
+    
+    # Remove the last node. Only used to undo insertNode, so no edge refers
+    # to it
+    def popNode(self):
+        self.nodes.pop()
+        self.touch()
     
-    # If we remove a node, we have to delete this node and update edge list
+    # Approximate memory used by this frame
+    def nBytes(self):
+        return NODE_BYTES * len(self.nodes) + EDGE_BYTES * len(self.edges)
+    
+    # If we remove a node, we have to delete this node and update edge list.
+    # Returns the removed node and the old topology, which is everything
+    # needed to restore it (see restoreNode)
     def removeNode(self, nodeIndex):
         # if index is invalid, return
         if nodeIndex < 0 or nodeIndex >= len(self.nodes):
-            return
+            return None, None
         # if not, delete
+        node = self.nodes[nodeIndex]
         del self.nodes[nodeIndex]
         
-        # Check edges
-        for i in range(len(self.edges)-1, -1, -1):
-            # If edge contain node, delete
-            edge = self.edges[i]
-            if edge[0] == nodeIndex or edge[1] == nodeIndex:
-                del self.edges[i]
-            else:
-                # If not, reduce bigger indexes (one edge was deleted)
-                if edge[0] > nodeIndex:
-                    edge[0] -= 1
-                if edge[1] > nodeIndex:
-                    edge[1] -= 1
+        # Edges with this node are dropped, and bigger indexes are reduced
+        oldTopology = self.topology
+        self.setTopology(oldTopology.withoutNode(nodeIndex))
+        return node, oldTopology
+    
+    # Put back a node removed by removeNode, with its edges
+    def restoreNode(self, nodeIndex, node, topology):
+        self.nodes.insert(nodeIndex, node)
+        self.setTopology(topology)
+    
+    # Remove many nodes at once. The edge list is rebuilt in a single pass
+    # with a remap table. Returns the old nodes and topology (for undo)
+    def removeNodes(self, nodeIndexes):
+        remap = np.zeros(len(self.nodes), dtype=int)
+        nodeIndexes = [i for i in nodeIndexes if 0 <= i < len(self.nodes)]
+        remap[nodeIndexes] = -1
+        
+        # Nodes that stay are numbered again in order
+        keep = remap == 0
+        remap[keep] = np.arange(np.count_nonzero(keep))
+        
+        oldNodes, oldTopology = self.nodes, self.topology
+        self.nodes = [node for node, kept in zip(oldNodes, keep) if kept]
+        self.setTopology(oldTopology.remapped(remap))
+        return oldNodes, oldTopology
+    
+    # Put back the nodes and topology returned by removeNodes
+    def restoreNodes(self, nodes, topology):
+        self.nodes = nodes
+        self.setTopology(topology)
+    
+    # Positions of some nodes (all if nodeIndexes is None), shape (n, 2).
+    # Nodes are read again only when the frame changes. The array of all
+    # nodes is shared, so it is read only
+    def positions(self, nodeIndexes = None):
+        cache = self.positionsCache
+        if cache is None or cache[0] != self.version or len(cache[1]) != len(self.nodes):
+            positions = [(node.x, node.y) for node in self.nodes]
+            positions = np.array(positions, dtype=np.float64).reshape(-1, 2)
+            positions.setflags(write=False)
+            cache = self.positionsCache = (self.version, positions)
+        
+        if nodeIndexes is None:
+            return cache[1]
+        return cache[1][np.asarray(nodeIndexes, dtype=np.intp)]
+    
+    # Move nodes to new positions (array with shape (n, 2))
+    def setPositions(self, nodeIndexes, positions):
+        for i, (x, y) in zip(nodeIndexes, positions):
+            self.nodes[i].setPos(x, y)
+        self.touch()
+    
+    # Copy of the nodes (positions and figures), sharing the topology. Later
+    # changes to this frame don't reach the copy
+    def copy(self):
+        frame = Frame(self.topology)
+        frame.nodes = [Node(node.x, node.y, node.figure) for node in self.nodes]
+        return frame
+    
+    # Indexes of all selected nodes
+    def selectedNodes(self):
+        return [i for i, node in enumerate(self.nodes) if node.isSelected]
+    
+    # Select all nodes inside a rectangle. If add is True, nodes already
+    # selected stay selected. Nodes of figures in skip are never selected
+    def selectInRect(self, x1, y1, x2, y2, add = False, skip = ()):
+        x1, x2 = min(x1, x2), max(x1, x2)
+        y1, y2 = min(y1, y2), max(y1, y2)
+        if not add:
+            for node in self.nodes:
+                node.isSelected = False
+        
+        # Only figures touching the rectangle are tested
+        positions = self.positions()
+        for name, indexes in self.figuresInArea((x1, y1, x2, y2), skip=skip):
+            points = positions[indexes]
+            inside = (points[:, 0] >= x1) & (points[:, 0] <= x2) &\
+                     (points[:, 1] >= y1) & (points[:, 1] <= y2)
+            for i in indexes[inside]:
+                self.nodes[i].isSelected = True
     
     # Edge is a connection between two nodes.
     def insertEdge(self, index1, index2, edgeType = 'line'):
         if index1 < 0 or index1 >= len(self.nodes) or\
             index2 < 0 or index2 >= len(self.nodes):
                 return
-        self.edges.append([index1, index2, edgeType])
+        self.setTopology(self.topology.withEdge(index1, index2, edgeType))
     
     # Returns a copy of a node addressed by index
     def getNode(self, index):
@@ -66,29 +371,77 @@ class Frame:
         return copy.deepcopy(self.nodes[index])
     
     # Selection threshold is the minimum distance of a click so the node is
-    # selected
-    def selectNode(self, x, y, selectionThreshold = 24):
-        ref = Node(x, y)
+    # selected. If toggle is True, the closest node is added to (or removed
+    # from) the selection and other nodes are kept as they are. Nodes of
+    # figures in skip (hidden or locked) can not be selected
+    def selectNode(self, x, y, selectionThreshold = 24, toggle = False, skip = ()):
         minDist = np.inf
         selectedIndex = None
         
-        # Go over all nodes
-        for i in range(len(self.nodes)):
-            # Unselect all nodes
-            self.nodes[i].isSelected = False
-            # check distance
-            distance = ref.distanceTo(self.nodes[i])
+        # Unselect all nodes
+        if not toggle:
+            for node in self.nodes:
+                node.isSelected = False
+        
+        # Figures whose box is far from the click are not even tested
+        positions = self.positions()
+        for name, indexes in self.figuresInArea((x, y, x, y), selectionThreshold, skip):
+            # check distance of all nodes of the figure at once
+            distances = np.hypot(positions[indexes, 0] - x, positions[indexes, 1] - y)
+            closest = np.argmin(distances)
             # See if this is the smallest distance found so far
-            if distance < minDist:
-                minDist = distance
-                selectedIndex = i
+            if distances[closest] < minDist:
+                minDist = distances[closest]
+                selectedIndex = indexes[closest]
         
         # If minimum distance is smaller than threshold, and there's any node,
         # select it
         if minDist <= selectionThreshold and selectedIndex is not None:
-            self.nodes[selectedIndex].isSelected = True
+            node = self.nodes[selectedIndex]
+            node.isSelected = not node.isSelected if toggle else True
 
     
+    # Distance from (x, y) to every edge, in one numpy pass. Lines are the
+    # segments between their nodes and circles are discs through them (the
+    # distance is zero inside)
+    def edgeDistances(self, x, y):
+        ids, circles = self.topology.indexArrays()
+        positions = self.positions()
+        start, end = positions[ids[:, 0]], positions[ids[:, 1]]
+        point = np.array([x, y], dtype=np.float64)
+        
+        # Closest point of each segment: the projection, kept between the ends
+        direction = end - start
+        lengths = np.einsum('ij,ij->i', direction, direction)
+        t = np.einsum('ij,ij->i', point - start, direction) / np.maximum(lengths, 1e-12)
+        closest = start + np.clip(t, 0, 1)[:, None] * direction
+        lineDistances = np.hypot(point[0] - closest[:, 0], point[1] - closest[:, 1])
+        
+        center = (start + end) / 2
+        radius = np.sqrt(lengths) / 2
+        circleDistances = np.hypot(point[0] - center[:, 0], point[1] - center[:, 1]) - radius
+        return np.where(circles, np.maximum(circleDistances, 0), lineDistances)
+    
+    # Select the edge closest to (x, y) if it is closer than the selection
+    # threshold, and return its index (or None). Edges go with the figure of
+    # their first node, those of figures in skip can not be selected
+    def selectEdge(self, x, y, selectionThreshold = 24, skip = ()):
+        self.selectedEdge = None
+        if len(self.edges) == 0:
+            return None
+        
+        distances = self.edgeDistances(x, y)
+        skipped = np.zeros(len(self.nodes), dtype=bool)
+        for name, (indexes, box) in self.figureBoxes().items():
+            if name in skip:
+                skipped[indexes] = True
+        distances[skipped[self.topology.indexArrays()[0][:, 0]]] = np.inf
+        
+        closest = int(np.argmin(distances))
+        if distances[closest] <= selectionThreshold:
+            self.selectedEdge = closest
+        return self.selectedEdge
+    
     # Edit the position of the selected node
     def editSelectedPosition(self, x, y):
         # Go over all nodes
@@ -96,54 +449,325 @@ class Frame:
             # If node is selected, edit and return
             if node.isSelected:
                 node.setPos(x, y)
+                self.touch()
                 break
 
 class StickmanFrames:
+    # Undo history where operations are recorded (see history.History). It
+    # is attached by the application and is never saved with the project
+    history = None
+    # Projects saved before nodes were stored in source video coordinates
+    # hold screen coordinates (see toSourceCoordinates)
+    sourceCoordinates = False
+    
     def __init__(self, imgWidth = 800, imgHeight = 600):
         # Garbage frame receives all thrash from index error
         self.garbageFrame = Frame()
         self.frames = []
         self.newByCopy = True
         
-        # Size of the screen
+        # Figures by name, and the one new nodes go to
+        self.figures = {DEFAULT_FIGURE: Figure(DEFAULT_FIGURE)}
+        self.activeFigure = DEFAULT_FIGURE
+        
+        # Size of the source video, in whose coordinates nodes are stored
         self.imgWidth  = imgWidth
         self.imgHeight = imgHeight
+        self.sourceCoordinates = True
     
     # number of frames
     def __len__(self):
         return len(self.frames)
     
-    # Insert a node on a frame
-    def insertNode(self, frameIndex, x, y):
+    # Approximate memory used by the animation. Shared topologies are
+    # counted once
+    def nBytes(self):
+        topologies = {id(frame.topology): len(frame.edges) for frame in self.frames}
+        return NODE_BYTES * sum(len(frame) for frame in self.frames) +\
+               EDGE_BYTES * sum(topologies.values())
+    
+    # History is left out when saving
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop('history', None)
+        return state
+    
+    # Projects saved before figures existed have only the default figure
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if 'figures' not in state:
+            self.figures = {DEFAULT_FIGURE: Figure(DEFAULT_FIGURE)}
+            self.activeFigure = DEFAULT_FIGURE
+    
+    # Set the resolution of the source video
+    def setResolution(self, imgWidth, imgHeight):
+        if imgWidth > 0 and imgHeight > 0:
+            self.imgWidth, self.imgHeight = imgWidth, imgHeight
+    
+    # Convert nodes of an old project from screen coordinates, as they were
+    # seen through transform, to source coordinates
+    def toSourceCoordinates(self, transform):
+        if self.sourceCoordinates:
+            return
+        for frame in self.frames:
+            if len(frame) > 0:
+                frame.setPositions(range(len(frame)), transform.toSource(frame.positions()))
+        self.sourceCoordinates = True
+    
+    # Line thickness in pixels when drawing through transform
+    def thicknessFor(self, lineThickness, transform):
+        return max(int(round(lineThickness * transform.scale * self.imgWidth /
+                             REFERENCE_WIDTH)), 1)
+    
+    # Create a figure (if it doesn't exist) and make it active
+    def addFigure(self, name):
+        if name not in self.figures:
+            self.figures[name] = Figure(name)
+        self.activeFigure = name
+    
+    # Names of figures that are hidden, and of those that can't be selected
+    def hiddenFigures(self):
+        return set(name for name, figure in self.figures.items() if not figure.visible)
+    
+    def lockedFigures(self):
+        return set(name for name, figure in self.figures.items()
+                   if figure.locked or not figure.visible)
+    
+    # Move nodes to another figure, on one frame or up to lastFrame
+    def assignFigure(self, frameIndex, nodeIndexes, name, lastFrame = None):
+        self.addFigure(name)
+        oldFigures = []
+        for i in self.frameRange(frameIndex, lastFrame):
+            frame = self.frames[i]
+            indexes = [j for j in nodeIndexes if j < len(frame)]
+            if len(indexes) == 0:
+                continue
+            oldFigures.append((i, indexes, [frame.nodes[j].figure for j in indexes]))
+            for j in indexes:
+                frame.nodes[j].figure = name
+            frame.touch()
+        if len(oldFigures) == 0:
+            return
+        
+        def undo():
+            for i, indexes, figures in oldFigures:
+                for j, figure in zip(indexes, figures):
+                    self.frames[i].nodes[j].figure = figure
+                self.frames[i].touch()
+        self.record(undo, lambda: self.assignFigure(frameIndex, nodeIndexes, name, lastFrame),
+                    64 * len(nodeIndexes) * len(oldFigures))
+    
+    # Register an undoable operation, if there's a history attached
+    def record(self, undo, redo, nBytes = 0, mergeKey = None):
+        if self.history is not None:
+            self.history.record(undo, redo, nBytes, mergeKey)
+    
+    # Compound operations use this so their inner steps are not recorded
+    def silently(self):
+        if self.history is None:
+            return contextlib.nullcontext()
+        return self.history.pause()
+    
+    # Drop frames beyond nFrames. Used to undo operations that grew the list
+    def truncate(self, nFrames):
+        del self.frames[nFrames:]
+    
+    # Insert a node on a frame. It goes to the active figure, if figure is
+    # not given
+    def insertNode(self, frameIndex, x, y, figure = None):
+        if figure is None:
+            figure = self.activeFigure
+        
         # If frame number is bigger than number of frames, make list grow to fit
+        nFrames = len(self.frames)
         if frameIndex >= len(self.frames):
             for i in range(frameIndex - len(self.frames) + 1):
                 self.frames.append(Frame())
         
         # Insert node on frame and return number of nodes in this frame
-        self.frames[frameIndex].insertNode(x, y)
+        self.frames[frameIndex].insertNode(x, y, figure)
+        
+        def undo():
+            self.frames[frameIndex].popNode()
+            self.truncate(nFrames)
+        self.record(undo, lambda: self.insertNode(frameIndex, x, y, figure), NODE_BYTES)
         return len(self.frames[frameIndex])-1
     
-    # Edit position of node in nodeIndex and in frame frameNumber
-    def editNode(self, frameIndex, nodeIndex, x, y):
-        self.getFrame(frameIndex).nodes[nodeIndex].setPos(x, y)
+    # Edit position of node in nodeIndex and in frame frameNumber. With
+    # merge, consecutive moves of the same node (like keyboard nudges) are
+    # undone at once
+    def editNode(self, frameIndex, nodeIndex, x, y, merge = False):
+        frame = self.getFrame(frameIndex)
+        node = frame.nodes[nodeIndex]
+        oldX, oldY = node.x, node.y
+        node.setPos(x, y)
+        frame.touch()
+        
+        mergeKey = ('editNode', frameIndex, nodeIndex) if merge else None
+        self.record(lambda: self.editNode(frameIndex, nodeIndex, oldX, oldY),
+                    lambda: self.editNode(frameIndex, nodeIndex, x, y),
+                    mergeKey=mergeKey)
         
     def removeNode(self, frameIndex, nodeIndex):
-        self.getFrame(frameIndex).removeNode(nodeIndex)
+        if frameIndex >= len(self.frames):
+            return
+        frame = self.frames[frameIndex]
+        node, oldTopology = frame.removeNode(nodeIndex)
+        if node is None:
+            return
+        
+        # Only the removed node and the old topology are kept. The topology is
+        # usually shared with other frames, so we count only the lost edges
+        lostEdges = len(oldTopology) - len(frame.topology)
+        self.record(lambda: self.frames[frameIndex].restoreNode(nodeIndex, node,
+                                                                oldTopology),
+                    lambda: self.removeNode(frameIndex, nodeIndex),
+                    NODE_BYTES + EDGE_BYTES * lostEdges)
     
     # Insert edge connecting nodes of indexes id1 and id2
     def insertEdge(self, frameIndex, id1, id2, edgeType = 'line'):
-        self.getFrame(frameIndex).insertEdge(id1, id2, edgeType)
+        frame = self.getFrame(frameIndex)
+        oldTopology = frame.topology
+        frame.insertEdge(id1, id2, edgeType)
+        
+        # Invalid edges are not inserted, so there's nothing to undo
+        if frame.topology is not oldTopology and frame is not self.garbageFrame:
+            self.record(lambda: self.frames[frameIndex].setTopology(oldTopology),
+                        lambda: self.insertEdge(frameIndex, id1, id2, edgeType),
+                        EDGE_BYTES)
+    
+    # Remove one edge. Its nodes and other edges stay as they are
+    def removeEdge(self, frameIndex, edgeIndex):
+        frame = self.getFrame(frameIndex)
+        if edgeIndex is None or edgeIndex < 0 or edgeIndex >= len(frame.edges):
+            return
+        oldTopology = frame.topology
+        frame.setTopology(oldTopology.withoutEdge(edgeIndex))
+        self.record(lambda: self.frames[frameIndex].setTopology(oldTopology),
+                    lambda: self.removeEdge(frameIndex, edgeIndex), EDGE_BYTES)
+    
+    # Change an edge from line to circle or the opposite
+    def toggleEdgeType(self, frameIndex, edgeIndex):
+        frame = self.getFrame(frameIndex)
+        if edgeIndex is None or edgeIndex < 0 or edgeIndex >= len(frame.edges):
+            return
+        oldTopology = frame.topology
+        edgeType = 'circle' if frame.edges[edgeIndex][2] == 'line' else 'line'
+        frame.setTopology(oldTopology.withEdgeType(edgeIndex, edgeType))
+        # The edge stays selected, so it can be toggled back
+        frame.selectedEdge = edgeIndex
+        self.record(lambda: self.frames[frameIndex].setTopology(oldTopology),
+                    lambda: self.toggleEdgeType(frameIndex, edgeIndex), EDGE_BYTES)
+    
+    # Select the edge closest to (x, y). Edges of locked or hidden figures
+    # can not be selected. Returns the index of the edge or None
+    def selectEdge(self, frameIndex, x, y, threshold = 24):
+        return self.getFrame(frameIndex).selectEdge(x, y, threshold,
+                                                    skip=self.lockedFigures())
+    
+    def selectedEdge(self, frameIndex):
+        return self.getFrame(frameIndex).selectedEdge
+    
+    def unselectEdge(self, frameIndex):
+        self.getFrame(frameIndex).selectedEdge = None
     
     # Substitute a frame for an empty frame
     def clearFrame(self, frameIndex):
         if frameIndex >= len(self.frames):
             return
+        oldFrame = self.frames[frameIndex]
         self.frames[frameIndex] = Frame()
+        
+        def undo():
+            self.frames[frameIndex] = oldFrame
+        self.record(undo, lambda: self.clearFrame(frameIndex), oldFrame.nBytes())
+    
+    # Select node. The selected node is identified by isSelected == True.
+    # With toggle, the node is added to or removed from the selection
+    # Nodes of hidden and locked figures are never selected. threshold is the
+    # maximum distance to the click, in source coordinates
+    def selectNode(self, frameIndex, x, y, toggle = False, threshold = 24):
+        self.getFrame(frameIndex).selectNode(x, y, threshold, toggle=toggle,
+                                             skip=self.lockedFigures())
+    
+    # Select nodes inside a rectangle
+    def selectNodesInRect(self, frameIndex, x1, y1, x2, y2, add = False):
+        self.getFrame(frameIndex).selectInRect(x1, y1, x2, y2, add,
+                                               skip=self.lockedFigures())
     
-    # Select node. The selected node is identified by isSelected == True
-    def selectNode(self, frameIndex, x, y):
-        self.getFrame(frameIndex).selectNode(x, y)
+    # Return indexes of all selected nodes in this frame
+    def selectedNodes(self, frameIndex):
+        return self.getFrame(frameIndex).selectedNodes()
+    
+    # Frames from frameIndex to lastFrame, that exist. frameIndex is always
+    # included, even if lastFrame is None or before it
+    def frameRange(self, frameIndex, lastFrame = None):
+        if lastFrame is None:
+            lastFrame = frameIndex
+        return range(frameIndex, min(max(frameIndex, lastFrame) + 1, len(self.frames)))
+    
+    # Apply an affine transform (2x3 matrix) to some nodes, on one frame or on
+    # every frame up to lastFrame. The transform is taken around the center
+    # of the nodes on each frame, so rotation and scale keep them in place.
+    # All nodes of a frame are transformed in one numpy operation
+    def transformNodes(self, frameIndex, nodeIndexes, matrix, lastFrame = None):
+        matrix = np.asarray(matrix, dtype=np.float64)
+        oldPositions = []
+        for i in self.frameRange(frameIndex, lastFrame):
+            frame = self.frames[i]
+            indexes = [j for j in nodeIndexes if j < len(frame)]
+            if len(indexes) == 0:
+                continue
+            
+            positions = frame.positions(indexes)
+            center = positions.mean(axis=0)
+            newPositions = (positions - center) @ matrix[:, :2].T + center + matrix[:, 2]
+            frame.setPositions(indexes, newPositions)
+            oldPositions.append((i, indexes, positions))
+        
+        if len(oldPositions) == 0:
+            return
+        
+        def undo():
+            for i, indexes, positions in oldPositions:
+                self.frames[i].setPositions(indexes, positions)
+        self.record(undo, lambda: self.transformNodes(frameIndex, nodeIndexes,
+                                                      matrix, lastFrame),
+                    sum(positions.nbytes for _, _, positions in oldPositions))
+    
+    # Move nodes by dx, dy
+    def translateNodes(self, frameIndex, nodeIndexes, dx, dy, lastFrame = None):
+        matrix = [[1, 0, dx], [0, 1, dy]]
+        self.transformNodes(frameIndex, nodeIndexes, matrix, lastFrame)
+    
+    # Rotate nodes by angle (degrees, clockwise on screen)
+    def rotateNodes(self, frameIndex, nodeIndexes, angle, lastFrame = None):
+        cos, sin = np.cos(np.radians(angle)), np.sin(np.radians(angle))
+        matrix = [[cos, -sin, 0], [sin, cos, 0]]
+        self.transformNodes(frameIndex, nodeIndexes, matrix, lastFrame)
+    
+    # Scale nodes by factor
+    def scaleNodes(self, frameIndex, nodeIndexes, factor, lastFrame = None):
+        matrix = [[factor, 0, 0], [0, factor, 0]]
+        self.transformNodes(frameIndex, nodeIndexes, matrix, lastFrame)
+    
+    # Remove many nodes, on one frame or on every frame up to lastFrame
+    def removeNodes(self, frameIndex, nodeIndexes, lastFrame = None):
+        removed = []
+        for i in self.frameRange(frameIndex, lastFrame):
+            frame = self.frames[i]
+            if not any(0 <= j < len(frame) for j in nodeIndexes):
+                continue
+            oldNodes, oldTopology = frame.removeNodes(nodeIndexes)
+            removed.append((i, oldNodes, oldTopology))
+        if len(removed) == 0:
+            return
+        
+        def undo():
+            for i, oldNodes, oldTopology in removed:
+                self.frames[i].restoreNodes(oldNodes, oldTopology)
+        self.record(undo, lambda: self.removeNodes(frameIndex, nodeIndexes, lastFrame),
+                    NODE_BYTES * len(nodeIndexes) * len(removed))
     
     # Unselect all nodes os this frame
     def unselectNodes(self, frameIndex):
@@ -157,36 +781,19 @@ class StickmanFrames:
                 return i
         return None
     
-    # Draw our graph above an image
+    # Draw our graph above an image. transform maps source coordinates to the
+    # image (by default they are the same) and lineThickness is in image
+    # pixels. Hidden figures and figures outside the image are skipped.
+    # engine (see renderEngine.RenderEngine) sets the drawing quality
     def drawFigure(self, frameIndex, background, lineThickness = 10,
-                 lineColor = (0, 255, 0), nodeColor = (0, 255, 0),
-                 selectedColor = (255, 0, 0), drawNodes = True):
-        
-        # Get frame
-        frame = self.getFrame(frameIndex)
-        
-        # For all edges in the frame
-        for id1, id2, edgeType in frame.edges:
-            # Get nodes 
-            node1 = frame.getNode(id1)
-            node2 = frame.getNode(id2)
-            
-            # Draw a line of a circle. Depending on line type
-            if edgeType == 'line':
-                cv2.line(background, (node1.x, node1.y), (node2.x, node2.y),
-                         lineColor, thickness = lineThickness)
-            elif edgeType == 'circle':
-                center = ((node1.x + node2.x) // 2, (node1.y + node2.y) // 2)
-                radius = int(np.sqrt((node1.x-node2.x)**2 + (node1.y-node2.y)**2) / 2)
-                cv2.circle(background, center, radius, lineColor, -1)
-        
-        # If draw nodes is True, print nodes as smaller circles
-        if drawNodes:
-            for node in frame.nodes:
-                # Color changes if node is selected
-                color = selectedColor if node.isSelected else nodeColor
-                cv2.circle(background, (node.x, node.y), radius = lineThickness,
-                           color = color, thickness = -1)
+                   lineColor = (0, 255, 0), nodeColor = (0, 255, 0),
+                   selectedColor = (255, 0, 0), drawNodes = True, transform = None,
+                   engine = None):
+        if engine is None:
+            engine = DEFAULT_ENGINE
+        engine.draw(background, self.getFrame(frameIndex), lineThickness, lineColor,
+                    nodeColor, selectedColor, drawNodes, transform,
+                    self.hiddenFigures())
     
     # This function is used internally. If a invalid index is requested, garbage
     # frame is returned
@@ -215,93 +822,240 @@ class StickmanFrames:
         
         # Append new frame by copy
         if source is not None:
-            for node in self.frames[source].nodes:
-                self.insertNode(frameIndex, node.x, node.y)
-            for edge in self.frames[source].edges:
-                self.insertEdge(frameIndex, edge[0], edge[1], edge[2])
+            nFrames = len(self.frames)
+            with self.silently():
+                for node in self.frames[source].nodes:
+                    self.insertNode(frameIndex, node.x, node.y, node.figure)
+            # Edges are not copied, both frames share the same topology
+            self.frames[frameIndex].setTopology(self.frames[source].topology)
+            
+            # The frame was empty before, or didn't exist
+            def undo():
+                self.frames[frameIndex] = Frame()
+                self.truncate(nFrames)
+            self.record(undo, lambda: self.repeatByCopy(frameIndex))
+    
+    # Write node positions for a range of frames in bulk. positions has shape
+    # (frames, nodes, 2) and starts at firstFrame. Each frame is replaced by
+    # a copy of source (a Frame with one node per position, usually a copy
+    # taken before the positions were computed) with the nodes moved
+    def setPositions(self, source, firstFrame, positions):
+        if positions.shape[1:] != (len(source), 2):
+            raise ValueError('Positions do not match the nodes of the source frame')
+        lastFrame = firstFrame + len(positions)
+        
+        # Replaced frames are kept as they are, to be put back on undo
+        nFrames = len(self.frames)
+        oldFrames = self.frames[firstFrame:lastFrame]
+        def undo():
+            self.frames[firstFrame:firstFrame+len(oldFrames)] = oldFrames
+            self.truncate(nFrames)
+        self.record(undo, lambda: self.setPositions(source, firstFrame, positions),
+                    sum(frame.nBytes() for frame in oldFrames) + positions.nbytes)
+        
+        if lastFrame > len(self.frames):
+            self.frames.extend(Frame() for i in range(lastFrame - len(self.frames)))
+        
+        for i, framePositions in enumerate(positions):
+            frame = Frame(source.topology)
+            frame.nodes = [Node(x, y, node.figure)
+                           for (x, y), node in zip(framePositions, source.nodes)]
+            self.frames[firstFrame + i] = frame
     
     # Interpolate is a function to fill all gaps in animation with intermediate
-    # steps. The filling is linear
-    def interpolate(self):
-        emptyIntervals = []
-        begin, end = 0, 0
-        for i in range(len(self.frames)):
-            # Found a non-empty frame
-            if len(self.frames[i]) > 0:
-                end = i
-            
-            # Here if we passed for a series of empty frames, end-begin > 1, so
-            # we save the interval
-            if begin is not None and end is not None and end - begin > 1:
-                emptyIntervals.append([begin, end])
-                
-            # Register begin for one more non-empty thing
-            begin = end
-        
-        # For all empty intervals found...
-        for interval in emptyIntervals:
-            # We will interpolate only the common nodes
-            nNodes = min(len(self.getFrame(interval[0])),
-                         len(self.getFrame(interval[1])))
-            
-            # Let's copy all nodes in the frames on the interval
-            for i in range(nNodes):
-                # Get the extreme nodes
-                node1 = self.getFrame(interval[0]).getNode(i)
-                node2 = self.getFrame(interval[1]).getNode(i)
-                
-                # Calculate the difference between their position
-                diffX = node2.x - node1.x
-                diffY = node2.y - node1.y
-                step = 1 / (interval[1]-interval[0])
-                
-                # Fill with new nodes in intermediate positions
-                for j in range(1, interval[1]-interval[0]):
-                    frameIndex = interval[0]+j
-                    x = node1.x + diffX * step * j
-                    y = node1.y + diffY * step * j
-                    self.insertNode(frameIndex, x, y)
+    # steps. mode is one of INTERPOLATION_MODES: linear, eased (slow in and
+    # out) or a Catmull-Rom spline through all non-empty frames. Every node
+    # of every gap frame is computed in one numpy pass
+    def interpolate(self, mode = LINEAR):
+        keys = [i for i, frame in enumerate(self.frames) if len(frame) > 0]
+        if len(keys) < 2:
+            return
+        
+        # Gaps are the empty frames between the first and last keyframes
+        isKey = np.zeros(keys[-1] + 1, dtype=bool)
+        isKey[keys] = True
+        filledFrames = np.flatnonzero(~isKey[keys[0]:]) + keys[0]
+        if len(filledFrames) == 0:
+            return
+        
+        positions, counts, segments = self.sampleKeyframes(keys, filledFrames, mode)
+        
+        # Frames filled here were all empty, so undo only has to know which
+        filledFrames = filledFrames.tolist()
+        def undo():
+            for frameIndex in filledFrames:
+                self.frames[frameIndex] = Frame()
+        self.record(undo, lambda: self.interpolate(mode), 8 * len(filledFrames))
+        
+        for j, frameIndex in enumerate(filledFrames):
+            self.frames[frameIndex] = self.frameFromPositions(keys[segments[j]],
+                                                              positions[j, :counts[j]])
+    
+    # Resample the whole animation in time. step is how many source frames
+    # pass for each new frame (old fps / new fps, or 0.5 to play at half
+    # speed). speedCurve, a list of (newFrame, speed) points, varies the step
+    # along the animation (linear between points). Nodes on every new frame
+    # are computed in one numpy pass over the keyframes
+    def retime(self, step = 1, speedCurve = None, mode = LINEAR):
+        keys = [i for i, frame in enumerate(self.frames) if len(frame) > 0]
+        if len(keys) == 0 or step <= 0:
+            return
+        
+        # Source time of each new frame
+        if speedCurve is None:
+            times = np.arange(0, keys[-1] + 1e-9, step)
+        else:
+            points = np.array(sorted(speedCurve), dtype=np.float64).reshape(-1, 2)
+            minSpeed = max(points[:, 1].min(), 1e-3)
+            nFrames = int(keys[-1] / (step * minSpeed)) + 2
+            speeds = np.interp(np.arange(nFrames), points[:, 0], points[:, 1])
+            times = np.concatenate([[0], np.cumsum(step * np.maximum(speeds, 1e-3))])
+            times = times[times <= keys[-1] + 1e-9]
+        
+        positions, counts, segments = self.sampleKeyframes(keys, times, mode)
+        
+        # Frames before the first keyframe stay empty
+        frames = []
+        for j, time in enumerate(times):
+            if time < keys[0] or counts[j] == 0:
+                frames.append(Frame())
+            else:
+                frames.append(self.frameFromPositions(keys[segments[j]],
+                                                      positions[j, :counts[j]]))
+        
+        oldFrames = self.frames
+        self.frames = frames
+        def undo():
+            self.frames = oldFrames
+        self.record(undo, lambda: self.retime(step, speedCurve, mode),
+                    sum(frame.nBytes() for frame in oldFrames))
+    
+    # New frame with nodes at positions, and the topology and figures of a
+    # keyframe (only edges between the nodes it has)
+    def frameFromPositions(self, keyIndex, positions):
+        keyFrame = self.frames[keyIndex]
+        frame = Frame(keyFrame.topology.restrictedTo(len(positions)))
+        frame.nodes = [Node(x, y, node.figure)
+                       for (x, y), node in zip(positions, keyFrame.nodes)]
+        return frame
+    
+    # Evaluate node positions at any times (frame numbers, may be fractional)
+    # from the keyframes. Returns positions with shape (times, nodes, 2),
+    # how many nodes each time has and the keyframe segment it falls in.
+    # Like in linear filling, a time between two keyframes only has the
+    # nodes both keyframes have. Times on a keyframe take all its nodes
+    def sampleKeyframes(self, keys, times, mode = LINEAR):
+        times = np.asarray(times, dtype=np.float64)
+        keys = np.asarray(keys)
+        counts = np.array([len(self.frames[k]) for k in keys])
+        
+        # Keyframe positions. Missing nodes are NaN
+        keyPositions = np.full((len(keys), counts.max(), 2), np.nan)
+        for k, keyIndex in enumerate(keys):
+            keyPositions[k, :counts[k]] = self.frames[keyIndex].positions()
+        
+        # A single keyframe can only be repeated
+        if len(keys) == 1:
+            segments = np.zeros(len(times), dtype=int)
+            positions = np.repeat(keyPositions, len(times), axis=0)
+            return positions, np.repeat(counts, len(times)), segments
+        
+        # Segment (pair of keyframes) and position inside it for each time
+        segments = np.searchsorted(keys, times, side='right') - 1
+        segments = np.clip(segments, 0, len(keys) - 2)
+        t1, t2 = keys[segments], keys[segments+1]
+        length = (t2 - t1)[:, None, None]
+        u = np.clip((times - t1) / (t2 - t1), 0, 1)[:, None, None]
+        p1, p2 = keyPositions[segments], keyPositions[segments+1]
+        
+        if mode == CATMULL_ROM:
+            # Tangents at keyframes, from their neighbours. At the ends, or
+            # when a neighbour lacks the node, the segment direction is used
+            tangents = np.full(keyPositions.shape, np.nan)
+            tangents[1:-1] = (keyPositions[2:] - keyPositions[:-2]) /\
+                             (keys[2:] - keys[:-2])[:, None, None]
+            chord = (p2 - p1) / length
+            m1 = np.where(np.isnan(tangents[segments]), chord, tangents[segments])
+            m2 = np.where(np.isnan(tangents[segments+1]), chord, tangents[segments+1])
             
-            # Now copy edges from the node in the beggining of the interval
-            for edge in self.getFrame(interval[0]).edges:
-                for j in range(1, interval[1]-interval[0]):
-                    frameIndex = interval[0]+j
-                    
-                    # Let's ignore edges that contain nodes we did not include
-                    if edge[0] < len(self.getFrame(frameIndex)) and\
-                       edge[1] < len(self.getFrame(frameIndex)):
-                        self.insertEdge(frameIndex, edge[0], edge[1], edge[2])
-                
+            # Cubic Hermite basis
+            u2, u3 = u * u, u * u * u
+            positions = (2*u3 - 3*u2 + 1) * p1 + (u3 - 2*u2 + u) * length * m1 +\
+                        (-2*u3 + 3*u2) * p2 + (u3 - u2) * length * m2
+        else:
+            if mode == EASE:
+                u = u * u * (3 - 2 * u)
+            positions = p1 + (p2 - p1) * u
+        
+        nodeCounts = np.minimum(counts[segments], counts[segments+1])
+        
+        # Exactly on a keyframe (or after the last one) we take the keyframe
+        onStart = times == t1
+        onEnd = times >= t2
+        positions[onStart] = p1[onStart]
+        positions[onEnd] = p2[onEnd]
+        nodeCounts[onStart] = counts[segments][onStart]
+        nodeCounts[onEnd] = counts[segments+1][onEnd]
+        segments = np.where(onEnd, segments+1, segments)
+        return positions, nodeCounts, segments
+    
+    # Export animation as a series of .png images. Images are width pixels
+    # wide (the source resolution by default), with the source proportion.
+    # workers images are drawn and written at the same time, with the png
+    # compression level given (0 to 9)
+    # Size of exported images for width (the video width if None)
+    def exportSize(self, width = None):
+        if width is None:
+            width = self.imgWidth
+        return width, int(round(width * self.imgHeight / self.imgWidth))
     
-    # Export animation as a series of .png images
-    def exportAnimation(self, folderPath, lineThickness = 10, lineColor = (1, 1, 1)):
-        # Background is fully transparent
-        backGround = np.zeros([self.imgHeight, self.imgWidth, 4], dtype=np.uint8)
-        # Avoid confusion with background
-        if lineColor == (0,0,0):
-            lineColor = (1,1,1)
+    def exportAnimation(self, folderPath, lineThickness = 10, lineColor = (1, 1, 1),
+                        width = None, engine = None, workers = 1, compression = 3):
+        width, height = self.exportSize(width)
+        
+        # Nodes are mapped straight to the export resolution
+        transform = ViewTransform(width / self.imgWidth)
+        lineThickness = self.thicknessFor(lineThickness, transform)
+        
+        # The figure is drawn opaque, the alpha channel goes with the color
+        lineColor = tuple(lineColor[:3]) + (255,)
+        # 0 is fastest, 9 makes the smallest files
+        params = [cv2.IMWRITE_PNG_COMPRESSION, compression]
+        
+        def exportFrame(frameIndex, fileName):
+            # Background is fully transparent
+            image = np.zeros([height, width, 4], dtype=np.uint8)
+            self.drawFigure(frameIndex, image, drawNodes=False,
+                            lineThickness=lineThickness, lineColor=lineColor,
+                            transform=transform, engine=engine)
+            # Smooth borders (antialiased or supersampled) were blended with
+            # the transparent background, so their color is darkened by their
+            # alpha. Undo that, as png colors are not multiplied by alpha
+            border = (image[:, :, 3] > 0) & (image[:, :, 3] < 255)
+            alpha = image[border, 3:].astype(np.float32) / 255
+            image[border, :3] = np.clip(image[border, :3] / alpha, 0, 255).astype(np.uint8)
+            cv2.imwrite(fileName, image, params)
         
-        # For all frames
+        # Images are drawn and written by workers threads (OpenCV releases
+        # the interpreter while it draws and compresses). Only a few images
+        # are in flight at once, so memory does not grow with the animation
+        workers = max(int(workers), 1)
         exportedImages = 0
-        for i, frame in enumerate(self.frames):
-            # If frame is empty, do not save
-            if len(frame.nodes) == 0:
-                continue
-            
-            # Copy default background
-            image = np.copy(backGround)
-            # Draw above it.
-            self.drawFigure(i, image, drawNodes=False, lineThickness=lineThickness, lineColor=lineColor)
-            # Figure color is almost full black, but it is not. So we can
-            # differentiate from background and apply transparency only on the
-            # right places.
-            mask = image[:, :, :3].sum(axis=2) > 0
-            image[mask, 3] = 255
-            
-            # Save figure
-            fileName = folderPath + '/' + str(exportedImages) + '.png'
-            cv2.imwrite(fileName, image)
-            exportedImages += 1
+        with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+            inFlight = collections.deque()
+            for i, frame in enumerate(self.frames):
+                # If frame is empty, do not save
+                if len(frame.nodes) == 0:
+                    continue
+                fileName = folderPath + '/' + str(exportedImages) + '.png'
+                inFlight.append(pool.submit(exportFrame, i, fileName))
+                exportedImages += 1
+                
+                # Errors (like a full disk) are raised here
+                while len(inFlight) > 2 * workers:
+                    inFlight.popleft().result()
+            for future in inFlight:
+                future.result()
     
     # Print frames, nodes, and edges info
     def describe(self, start = 0, end = -1):
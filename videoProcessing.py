@@ -1,10 +1,16 @@
 import cv2
+import collections
 import numpy as np
 
+from viewTransform import ViewTransform
+
 # I find a little weird to use 0, 1 index for height and width, so we will use
 # some contants
 X, Y = 1, 0
 
+# Frames skipped by reading instead of seeking (see VideoProcessing.decode)
+MAX_GRAB = 8
+
 # This auxiliary function converts a set of images to frames in a video.
 def imagesToVideo(imagePathList = [], outPath = 'temp.avi', fps = 24):
     # imagePathList: a list of path of images to convert to frames on a video
@@ -28,78 +34,162 @@ def imagesToVideo(imagePathList = [], outPath = 'temp.avi', fps = 24):
 class VideoProcessing:
     def __init__(self, path):
         # load video from path
+        self.path = path
         self.frames = cv2.VideoCapture(path)
         # size of the video
         self.nFrames = int(self.frames.get(cv2.CAP_PROP_FRAME_COUNT))
+        # frames per second of the source, used for playback
+        self.fps = self.frames.get(cv2.CAP_PROP_FPS)
+        # resolution of the source. Nodes are stored in these coordinates
+        self.sourceWidth = int(self.frames.get(cv2.CAP_PROP_FRAME_WIDTH))
+        self.sourceHeight = int(self.frames.get(cv2.CAP_PROP_FRAME_HEIGHT))
         # variable to hold current frame
         self.frame = None
+        # Index of the last frame read from the video, so the next one in
+        # sequence is read without seeking
+        self.rawIndex = None
+        # Recently decoded frames (as they come from the video), by index.
+        # Zoom, translation and going back and forth over the same frames
+        # don't decode again. The least recently used is dropped first
+        self.decodeCache = collections.OrderedDict()
+        self.decodeCacheSize = 8
+        # Previews compute one pixel every previewDownscale (see setFrame)
+        self.previewDownscale = 2
     
         self.actualFrame = 0
-        self.translation = np.array([0, 0], dtype=np.int)
+        self.translation = np.array([0, 0], dtype=int)
         self.extraImageWidth = 0
+        self.frameSize = (600, 800, 3)
     
-    # Run to the required frame and process it
-    def setFrame(self, frameIndex = None, frameSize = (600, 800, 3)):
+    # Run to the required frame and process it. A preview is made from a
+    # fraction of the pixels with the cheapest resize, for continuous
+    # interaction (scrubbing or zooming)
+    def setFrame(self, frameIndex = None, frameSize = None, preview = False):
         if frameIndex is None:
             frameIndex = self.actualFrame
+        if frameSize is None:
+            frameSize = self.frameSize
+        self.frameSize = frameSize
         
         self.actualFrame = frameIndex
         if frameIndex >= self.nFrames:
             self.actualFrame = self.nFrames-1
         
-        if self.nFrames > 1 or self.frame is None:
-            self.frames.set(cv2.CAP_ANY, frameIndex)
-            _, self.frame = self.frames.read()
-        self.frame = self.processFrame(self.frame, frameSize)
+        frame = self.decode(self.actualFrame)
+        if preview:
+            self.frame = self.processFrame(frame, frameSize, cv2.INTER_NEAREST,
+                                           max(int(self.previewDownscale), 1))
+        else:
+            self.frame = self.processFrame(frame, frameSize)
+    
+    # Return the frame as it comes from the video (BGR, source resolution).
+    # Frames in the cache are not decoded again. Seeking is expensive, so the
+    # next frame in sequence is just read
+    def decode(self, frameIndex):
+        frame = self.decodeCache.get(frameIndex)
+        if frame is not None:
+            self.decodeCache.move_to_end(frameIndex)
+            return frame
+        
+        # A few frames ahead (like stepping by frame jump) are skipped without
+        # being converted, which is cheaper than seeking
+        skip = frameIndex - self.rawIndex - 1 if self.rawIndex is not None else -1
+        if 0 < skip <= MAX_GRAB:
+            for i in range(skip):
+                self.frames.grab()
+        elif skip != 0:
+            self.frames.set(cv2.CAP_PROP_POS_FRAMES, frameIndex)
+        _, frame = self.frames.read()
+        self.rawIndex = frameIndex
+        if frame is None:
+            return None
+        
+        # Some containers don't report their resolution
+        if self.sourceWidth <= 0:
+            self.sourceHeight, self.sourceWidth = frame.shape[:2]
+        
+        self.decodeCache[frameIndex] = frame
+        self.trimCache()
+        return frame
+    
+    # Transform from source video coordinates to the screen, for the actual
+    # zoom and translation
+    def viewTransform(self):
+        imageWidth = self.frameSize[X] + self.extraImageWidth
+        sourceWidth = self.sourceWidth if self.sourceWidth > 0 else self.frameSize[X]
+        return ViewTransform(imageWidth / sourceWidth, self.translation[X],
+                             self.translation[Y])
     
     # Just return 
     def getFrame(self):
         return self.frame
     
-    # Fit frame on frame screen
-    def processFrame(self, frame, frameSize):
+    # Fit frame on frame screen. Instead of resizing the whole frame and
+    # cropping the visible part, source pixels are mapped straight to the
+    # screen, so only pixels on screen are computed whatever the zoom.
+    # interpolation is the cv2 method. With downscale > 1 one pixel every
+    # downscale is computed and enlarged (for previews)
+    def processFrame(self, frame, frameSize, interpolation = cv2.INTER_LINEAR,
+                     downscale = 1):
         if frame is None:
             return
-        #Get frame in RGB
-        image = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        imageWidth = frameSize[X] + self.extraImageWidth
+        width, height = frameSize[X] // downscale, frameSize[Y] // downscale
         
-        # Calculate image height based on width. Note that image size can be
-        # changed with the zoomming process
-        proportion = image.shape[Y] / image.shape[X]
-        imageHeight = int(imageWidth * proportion)
-        image = cv2.resize(image, (imageWidth, imageHeight))
+        # Same mapping as resizing to the zoomed width (pixel centers stay
+        # aligned) and then translating. Outside the image is pure black
+        scale = (frameSize[X] + self.extraImageWidth) / frame.shape[X]
+        offset = 0.5 * scale - 0.5
+        matrix = np.array([[scale, 0, self.translation[X] + offset],
+                           [0, scale, self.translation[Y] + offset]]) / downscale
+        image = cv2.warpAffine(frame, matrix, (width, height), flags=interpolation,
+                               borderMode=cv2.BORDER_CONSTANT, borderValue=0)
+        if downscale > 1:
+            image = cv2.resize(image, (frameSize[X], frameSize[Y]),
+                               interpolation=cv2.INTER_NEAREST)
         
-        # Frame background is pure black
-        frame = np.zeros(frameSize, dtype=np.uint8)
-        imShape = image.shape[:2]
-        
-        # Those variables get the visible part of the image in the frame
-        pfX1 = max(self.translation[X], 0)
-        pfY1 = max(self.translation[Y], 0)
-        pfX2 = min(imShape[X] + self.translation[X], frameSize[X])
-        pfY2 = min(imShape[Y] + self.translation[Y], frameSize[Y])
-        
-        piX1 = max(-self.translation[X], 0)
-        piY1 = max(-self.translation[Y], 0)
-        piX2 = piX1 + (pfX2 - pfX1)
-        piY2 = piY1 + (pfY2 - pfY1)
-        
-        # Copy image visible part
-        frame[pfY1:pfY2, pfX1:pfX2] = image[piY1:piY2, piX1:piX2]
-        
-        return frame
+        #Get frame in RGB
+        return cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    
+    # Change how many decoded frames are kept. Extra ones are dropped now,
+    # least recently used first
+    def setCacheSize(self, size):
+        self.decodeCacheSize = size
+        self.trimCache()
+    
+    def trimCache(self):
+        while len(self.decodeCache) > max(self.decodeCacheSize, 1):
+            self.decodeCache.popitem(last=False)
+    
+    # Memory used by decoded frames and the frame on screen
+    def nBytes(self):
+        total = sum(frame.nbytes for frame in self.decodeCache.values())
+        if self.frame is not None:
+            total += self.frame.nbytes
+        return total
+    
+    # Drop the least recently used decoded frames until nBytes are freed. The
+    # last one is kept, it is usually the one on screen. Returns bytes freed
+    def evict(self, nBytes):
+        freed = 0
+        while freed < nBytes and len(self.decodeCache) > 1:
+            freed += self.decodeCache.popitem(last=False)[1].nbytes
+        return freed
     
-    # zoom-in (factor > 0) or zoom-out image (factor < 0)
-    def zoom(self, factor):
-        self.extraImageWidth += int(factor)
-        self.setFrame()
+    # zoom-in (factor > 0) or zoom-out image (factor < 0). If update is False
+    # the frame is not processed, so many changes can be applied at once
+    def zoom(self, factor, update = True):
+        # The image is never narrower than a few pixels
+        self.extraImageWidth = max(self.extraImageWidth + int(factor),
+                                   16 - self.frameSize[X])
+        if update:
+            self.setFrame()
     
     # move image in pixels scale
-    def translate(self, x = 0, y = 0):
+    def translate(self, x = 0, y = 0, update = True):
         self.translation[X] = self.translation[X] + int(x)
         self.translation[Y] = self.translation[Y] + int(y)
-        self.setFrame()
+        if update:
+            self.setFrame()
 
 if __name__ == '__main__':
     imagePath = 'initialScreen.png'
@@ -0,0 +1,41 @@
+import numpy as np
+
+# Nodes are stored in source video pixels. A view transform maps them to the
+# pixels of the screen or of an exported image:
+#     screen = source * scale + offset
+class ViewTransform:
+    def __init__(self, scale = 1.0, offsetX = 0, offsetY = 0):
+        self.scale = float(scale)
+        self.offset = np.array([offsetX, offsetY], dtype=np.float64)
+
+    def __eq__(self, other):
+        return isinstance(other, ViewTransform) and self.key() == other.key()
+
+    def __hash__(self):
+        return hash(self.key())
+
+    # Hashable description, used by caches of things drawn with a transform
+    def key(self):
+        return (self.scale, float(self.offset[0]), float(self.offset[1]))
+
+    # Map an array of points with shape (n, 2) from source to screen
+    def toScreen(self, points):
+        return np.asarray(points, dtype=np.float64) * self.scale + self.offset
+
+    # Map an array of points with shape (n, 2) from screen to source
+    def toSource(self, points):
+        return (np.asarray(points, dtype=np.float64) - self.offset) / self.scale
+
+    # Map a distance (like a selection threshold) from screen to source
+    def lengthToSource(self, length):
+        return length / self.scale
+
+    # The same view drawn factor times bigger (used for supersampling)
+    def scaled(self, factor):
+        return ViewTransform(self.scale * factor, self.offset[0] * factor,
+                             self.offset[1] * factor)
+
+    # Rectangle (x1, y1, x2, y2) of the source seen on a screen of this size
+    def visibleArea(self, width, height):
+        (x1, y1), (x2, y2) = self.toSource([(0, 0), (width, height)])
+        return (x1, y1, x2, y2)